@@ -1,4 +1,14 @@
+import pandas as pd
 import streamlit as st
+from utils.media import check_media
+
+# Copy-on-write lets every session share the cached frames: a page that
+# modifies the frame it was handed gets its own copy of the touched columns
+# instead of changing the one other sessions are reading (see utils/data.py)
+pd.set_option('mode.copy_on_write', True)
+
+# report missing media once at startup
+check_media()
 
 # pages
 resume = st.Page(
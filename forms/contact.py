@@ -1,9 +1,16 @@
 import streamlit as st
 import re
-import requests
+import sqlite3
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from utils.outbox import submit
+from utils.rate_limit import admit, release
 
 WEBHOOK_URL = st.secrets['WEBHOOK_URL']
 
+MAX_NAME_LENGTH = 100
+MAX_EMAIL_LENGTH = 254
+MAX_MESSAGE_LENGTH = 5000
+
 def is_valid_email(email):
     email_pattern = r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-.]+$"
     return re.match(email_pattern, email) is not None
@@ -21,17 +28,22 @@ def contact_form():
                 st.error('Error with the email service. Try again later.')
                 st.stop()
 
-            if not first_name: 
-                st.error('Please provide your name.')
-            
-            if not email: 
-                st.error('Please provide your email address.')
-                         
-            if not is_valid_email(email): 
-                st.error('Please provide a valid email address.')
-                         
-            if not message: 
-                st.error('Please provide a message.')
+            # every problem is shown at once, and nothing else runs until
+            # the form is valid
+            errors = []
+            if not first_name:
+                errors.append('Please provide your name.')
+            if not email:
+                errors.append('Please provide your email address.')
+            elif not is_valid_email(email):
+                errors.append('Please provide a valid email address.')
+            if not message:
+                errors.append('Please provide a message.')
+            if len(first_name) > MAX_NAME_LENGTH or len(email) > MAX_EMAIL_LENGTH or len(message) > MAX_MESSAGE_LENGTH:
+                errors.append('Please shorten your name, email or message.')
+            if errors:
+                for error in errors:
+                    st.error(error)
                 st.stop()
 
             data = {
@@ -39,9 +51,23 @@ def contact_form():
                 'name': first_name,
                 'message': message
             }
-            response = requests.post(WEBHOOK_URL, json=data)
+            # throttled per session and address, and repeats dropped, before
+            # anything is queued for the webhook
+            session_id, address = get_script_run_ctx().session_id, st.context.ip_address
+            refused = admit(data, session_id, address)
+            if refused == 'rate_limited':
+                st.error('Too many messages, please try again in a few minutes.')
+                st.stop()
+            if refused == 'duplicate':
+                st.info('This message was already sent.')
+                st.stop()
 
-            if response.status_code == 200:
-                st.success('Your message has been sent successfully!')
-            else:
-                st.error('There was an error sending your message.')
\ No newline at end of file
+            # stored and delivered in the background, retried if the webhook is down
+            try:
+                submit(data, WEBHOOK_URL)
+            except (sqlite3.Error, OSError):
+                # not stored, so a retry must not count as a repeat
+                release(data, session_id, address)
+                st.error('There was an error sending your message.')
+                st.stop()
+            st.success('Your message has been sent successfully!')
\ No newline at end of file
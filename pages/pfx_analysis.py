@@ -2,10 +2,23 @@
 import streamlit as st 
 import pandas as pd
 import plotly.express as px
-from utils.streamlit_components import pitch_movement_chart, pitch_performance_vs_usage
-import json
-from plotly.io import from_json
-
+from utils.streamlit_components import pitch_movement_chart, pitch_performance_vs_usage, plotly_json_chart, score_pitch_widget
+from utils.data import UPPER_QUARTILE, load_pitch_data
+from utils.figure_cache import figure_json, load_figure_json
+from utils.images import image_variant
+from utils.media import video
+from utils.model_search import best_rung, leaderboard_frame, load_leaderboard
+from utils.registry import active_metadata, artifact_path
+from utils.rankings import top_undervalued
+
+SEASONS = [2025]
+
+# The interactive charts are fragments (see utils/streamlit_components.py), so
+# their widgets only rerun their own chart. Everything else on this page runs
+# on a full page load and reads its figures from the process caches.
+# Model figures and metrics come from the active model registry version
+# (see utils/registry.py), so activating a new model shows up on the next
+# rerun without restarting the app.
 
 st.html("""
     <style>
@@ -28,8 +41,7 @@ st.markdown("""
 
 
 ##### Intro ######
-df = pd.read_csv('./data/pitch_movement.csv')
-df = df.dropna()
+df = load_pitch_data(SEASONS)
 
 st.title('Identifying Undervalued Free Agents Using PFX Data')
 st.write(
@@ -55,10 +67,11 @@ with boxplot_col1:
         """
     )
 with boxplot_col2:
-    velo_order = df.groupby('pitch_type_name')['avg_speed'].mean().sort_values(ascending=False).index.to_list()
-    fig = px.box(df, x='pitch_type_name', y='avg_speed', title='Average Speed by Pitch Type', category_orders={'pitch_type_name': velo_order})
+    def build_boxplot():
+        velo_order = df.groupby('pitch_type_name', observed=True)['avg_speed'].mean().sort_values(ascending=False).index.to_list()
+        return px.box(df, x='pitch_type_name', y='avg_speed', title='Average Speed by Pitch Type', category_orders={'pitch_type_name': velo_order})
     # fig.show()
-    st.plotly_chart(fig, use_container_width=True)
+    plotly_json_chart(figure_json('speed_boxplot', tuple(SEASONS), build_boxplot, SEASONS))
 
 
 ##### Plot 2: Usage vs Performance #####
@@ -73,7 +86,7 @@ st.write(
         I included the average xSLG on the graph. I will spend a majority of my analysis focused on quadrant 3 (low usage, low xSLG) to find pitches that could be undervalued.
     """
 )
-pitch_performance_vs_usage()
+pitch_performance_vs_usage(SEASONS)
 
 st.divider()
 
@@ -89,7 +102,7 @@ st.write(
         Use the filters on the left to customize the pitch movement scatter plot.
     """
 )
-pitch_movement_chart()
+pitch_movement_chart(SEASONS)
 st.divider()
 
 ##### Modeling #####
@@ -139,11 +152,7 @@ st.write(
     """
 )
 try:
-    with open('media/model_results/feature_importance.json', 'r') as f:
-        json_str = json.load(f)
-        fig_fi = from_json(json_str)
-
-    st.plotly_chart(fig_fi, use_container_width=True)
+    plotly_json_chart(load_figure_json(artifact_path('feature_importance.json')))
 except FileNotFoundError:
     st.warning('Feature importance file not found.')
 
@@ -157,35 +166,131 @@ st.write(
 )
 
 try:
-    with open('media/model_results/roc_curve_fig.json', 'r') as f:
-        fig_json_string = json.load(f)
-        fig_roc = from_json(fig_json_string)
-        
-    st.plotly_chart(fig_roc, use_container_width=True) 
-    
+    plotly_json_chart(load_figure_json(artifact_path('roc_curve_fig.json')))
+    st.write(
+        f"""
+            Above is the ROC curve from the model.
+            The Receiver Operating Characteristic (ROC) curve is a graph that shows the performance of a classification model.
+            It plots the True Positive Rate (TPR) against the False Positive Rate (FPR).
+            A perfect model would have an ROC curve that is a right angle.
+            The model achieved an **Area Under the Curve (AUC)** of **{active_metadata()['metrics']['roc_auc']:.4f}** which is considered very strong.
+        """
+    )
 except FileNotFoundError:
     st.warning("ROC Curve figure not found.")
 
+try:
+    df_leaderboard = best_rung(leaderboard_frame(load_leaderboard()))
+    st.write(
+        f"""
+            To check whether a Random Forest was the right choice, I ran a search over three model families (Random Forest, Gradient Boosting and Logistic Regression).
+            Every configuration was scored with 5-fold cross validation on a quarter of the training data, and only the better half moved on to the next round with more data. \n
+            The configurations that made it to the last round reached ({df_leaderboard['train_fraction'].max():.0%} of the training data) are shown below, along with the test set AUC for the top configuration of each family.
+        """
+    )
+    st.dataframe(
+        df_leaderboard.drop(columns=['status', 'train_fraction']),
+        hide_index=True,
+        column_config={
+            'cv_auc': st.column_config.NumberColumn('CV AUC', format='%.4f'),
+            'cv_auc_std': st.column_config.NumberColumn('CV AUC Std', format='%.4f'),
+            'test_auc': st.column_config.NumberColumn('Test AUC', format='%.4f'),
+        }
+    )
+except FileNotFoundError:
+    st.warning('Model comparison leaderboard not found.')
+
 st.write(
     """
-        Above is the ROC curve from the model.
-        The Receiver Operating Characteristic (ROC) curve is a graph that shows the performance of a classification model.
-        It plots the True Positive Rate (TPR) against the False Positive Rate (FPR).
-        A perfect model would have an ROC curve that is a right angle.
-        The model achieved an **Area Under the Curve (AUC)** of **0.9418** which is considered very strong.
+        Want to try the model yourself? Describe a pitch below and the model will estimate how likely it is to be an "elite" swing-and-miss pitch.
+        The inputs start at the league median for each feature.
     """
 )
+try:
+    score_pitch_widget(SEASONS)
+except FileNotFoundError:
+    st.warning('Saved model not found.')
 
 
 st.divider()
 ##### Findings #####
 st.subheader("Findings")
+st.write(
+    """
+        I scored every pitch with the model and ranked the ones in quadrant 3 (below median usage, below league average xSLG) by their probability of being elite.
+        The top 10 are listed below, and two of them are broken down in more detail after the table.
+    """
+)
+try:
+    st.dataframe(
+        top_undervalued(10)[['undervalued_rank', 'pitcher_name', 'pitch_type_name', 'pitch_per', 'est_slg', 'whiff_percent', 'proba_elite']],
+        hide_index=True,
+        column_config={
+            'undervalued_rank': st.column_config.NumberColumn('Rank'),
+            'pitcher_name': st.column_config.TextColumn('Pitcher'),
+            'pitch_type_name': st.column_config.TextColumn('Pitch'),
+            'pitch_per': st.column_config.NumberColumn('Usage', format='%.3f'),
+            'est_slg': st.column_config.NumberColumn('xSLG', format='%.3f'),
+            'whiff_percent': st.column_config.NumberColumn('Whiff %', format='%.1f'),
+            'proba_elite': st.column_config.ProgressColumn('Elite Probability', min_value=0, max_value=1, format='%.2f'),
+        }
+    )
+except FileNotFoundError:
+    st.warning('Pitch rankings not found.')
+
+# within pitch type percentiles are stored with the data (see utils/data.py)
+df_upper_breaks = df[
+    df['upper_quartile_breaks']
+    & (df['pitch_per'] < df['pitch_per'].median())
+    & (df['est_slg'] < 0.42)
+]
+st.write(
+    f"""
+        Looking at movement alone, {df['upper_quartile_breaks'].sum()} pitches are in the upper quartile of their pitch type for both horizontal and induced vertical break.
+        {len(df_upper_breaks)} of them are also in quadrant 3:
+    """
+)
+st.dataframe(
+    df_upper_breaks.sort_values('whiff_percent', ascending=False)[
+        ['pitcher_name', 'pitch_type_name', 'pitcher_break_x', 'pitcher_break_x_pct', 'pitcher_break_z_induced', 'pitcher_break_z_induced_pct', 'pitch_per', 'est_slg', 'whiff_percent']
+    ],
+    hide_index=True,
+    column_config={
+        'pitcher_name': st.column_config.TextColumn('Pitcher'),
+        'pitch_type_name': st.column_config.TextColumn('Pitch'),
+        'pitcher_break_x': st.column_config.NumberColumn('Horz Break', format='%.1f'),
+        'pitcher_break_x_pct': st.column_config.NumberColumn('Horz Break Pct', format='%.2f'),
+        'pitcher_break_z_induced': st.column_config.NumberColumn('Vert Break', format='%.1f'),
+        'pitcher_break_z_induced_pct': st.column_config.NumberColumn('Vert Break Pct', format='%.2f'),
+        'pitch_per': st.column_config.NumberColumn('Usage', format='%.3f'),
+        'est_slg': st.column_config.NumberColumn('xSLG', format='%.3f'),
+        'whiff_percent': st.column_config.NumberColumn('Whiff %', format='%.1f'),
+    }
+)
+
+def break_standing(pct):
+    if pct >= UPPER_QUARTILE:
+        return 'in the upper quartile'
+    return 'above average' if pct >= 0.5 else 'below average'
+
+
+def break_summary(pitcher_name, pitch_type_name):
+    # Where the pitch's breaks rank within its pitch type, from the stored
+    # percentiles so the write-ups follow the data
+    pitch = df[(df['pitcher_name'] == pitcher_name) & (df['pitch_type_name'] == pitch_type_name)].iloc[0]
+    if pitch['upper_quartile_breaks']:
+        return 'in the upper quartile for both horizontal and induced vertical break'
+    horz, vert = break_standing(pitch['pitcher_break_x_pct']), break_standing(pitch['pitcher_break_z_induced_pct'])
+    if horz == vert:
+        return f'{horz} for both horizontal and induced vertical break'
+    return f'{horz} for horizontal break and {vert} for induced vertical break'
+
 
 # Chris Bassitt
 with st.container(border=True, vertical_alignment='center'):
     header_col1, header_col2, header_col3 = st.columns([1,3,1], gap='small', vertical_alignment='center',)
     with header_col1:
-        st.image('media/images/chirs_bassitt_headshot.png', use_container_width=True)
+        st.image(image_variant('chirs_bassitt_headshot.png'), use_container_width=True)
     with header_col2:
         st.markdown('<h2 class="centered-subheader">Chris Bassitt: Curveball</h2>', unsafe_allow_html=True)
 
@@ -201,11 +306,11 @@ with st.container(border=True, vertical_alignment='center'):
             """
         )
 
-    st.video('media/videos/chris_bassitt_k.mp4')
-    st.image('media/images/chris_bassitt_curveball_movement.png', caption='Figure 1')
+    video('media/videos/chris_bassitt_k.mp4')
+    st.image(image_variant('chris_bassitt_curveball_movement.png'), caption='Figure 1')
     st.write(
-        """
-            If you look at Figure 1, you'll see a curveball that's in the upper quartile for both horizontal and induced vertical break.
+        f"""
+            If you look at Figure 1, you'll see a curveball that's {break_summary('Bassitt, Chris', 'Curveball')}.
             That pitch belongs to Chris Bassitt, who surprisingly used it only **16%** of the time. 
             With that much movement, plus factoring in the **71.3** average velocity (20 MPH slower than his fastball), the makings of this pitch look very promising.
             However, just because the metrics look good, doesn't mean the pitch was effective.
@@ -227,7 +332,7 @@ with st.container(border=True, vertical_alignment='center'):
 with st.container(border=True, vertical_alignment='center'):
     header_col1, header_col2, header_col3 = st.columns([1,3,1], gap='small', vertical_alignment='center',)
     with header_col1:
-        st.image('media/images/nick_martinez_headshot.png', use_container_width=True)
+        st.image(image_variant('nick_martinez_headshot.png'), use_container_width=True)
     with header_col2:
         st.markdown('<h2 class="centered-subheader">Nick Martinez: Changeup</h2>', unsafe_allow_html=True)
 
@@ -243,13 +348,13 @@ with st.container(border=True, vertical_alignment='center'):
             """
         )
 
-    st.video('media/videos/nick_martinez_k.mp4')
-    st.image('media/images/nick_martinez_changeup_movement.png', caption='Figure 2')
+    video('media/videos/nick_martinez_k.mp4')
+    st.image(image_variant('nick_martinez_changeup_movement.png'), caption='Figure 2')
     st.write(
-        """
+        f"""
         Nick Martinez and his changeup were another interesting find.\n
         Figure 2 shows the pitch has low usage (20%) while sigificanly under the average xSLG relative to the rest of the league (0.32 vs 0.42).
-        The pitch also has above average horizontal and vertical break relative to other changeups.
+        The pitch is also {break_summary('Martinez, Nick', 'Changeup')} relative to other changeups.
         He throws 6 pitches, but his changeup was his best performing pitch by a wide margin. 
         It led in all expected stats yet again. (https://baseballsavant.mlb.com/savant-player/nick-martinez-607259?stats=statcast-r-pitching-mlb#pitch_tracking) \n 
 
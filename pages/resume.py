@@ -1,5 +1,7 @@
 import streamlit as st 
 from forms.contact import contact_form
+from utils.downloads import latest_resume, pdf_download_button
+from utils.images import image_variant
 
 
 st.html("""
@@ -22,7 +24,7 @@ with main_col1:
     
     sub_col1, sub_col2 = st.columns([1,2], gap='small', vertical_alignment='center')
     with sub_col1: 
-        st.image('./media/images/dylan_mcgee_profile_photo_cropped.png', width = 250)
+        st.image(image_variant('dylan_mcgee_profile_photo_cropped.png'), width = 250)
     with sub_col2:
         st.title('Dylan McGee')
         st.write('Data Scientist with 5 years of experience converting data into actionable insights across sports ticketing and brand sponsorship.')
@@ -31,14 +33,7 @@ with main_col1:
             if st.button('Contact Me'):
                 show_contact_form()
         with btn2:
-            with open('media/pdf/dylan_mcgee_resume_20251120.pdf', "rb") as f:
-                pdf_data = f.read()
-            st.download_button(
-                label="Download Resume",
-                data=pdf_data,
-                file_name="dylan_mcgee_resume_20251120.pdf",
-                mime="application/pdf"
-)
+            pdf_download_button('Download Resume', latest_resume())
 
 
     # experience
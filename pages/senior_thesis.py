@@ -1,26 +1,11 @@
 import streamlit as st
+from utils.downloads import pdf_download_button
+from utils.images import image_variant
 
 st.title('Senior Thesis')
 
-with open('media/pdf/dylan_mcgee_senior_thesis_literature_review.pdf', "rb") as f:
-    pdf_data = f.read()
+pdf_download_button('📄 Download Literature Review', 'media/pdf/dylan_mcgee_senior_thesis_literature_review.pdf')
+pdf_download_button('📄 Download PDF', 'media/pdf/dylan_mcgee_senior_thesis_poster.pdf')
 
-st.download_button(
-    label="📄 Download Literature Review",
-    data=pdf_data,
-    file_name="media/pdf/dylan_mcgee_senior_thesis_literature_review.pdf",
-    mime="application/pdf"
-)
-
-with open('media/pdf/dylan_mcgee_senior_thesis_poster.pdf', "rb") as f:
-    pdf_data = f.read()
-
-st.download_button(
-    label="📄 Download PDF",
-    data=pdf_data,
-    file_name="media/pdf/dylan_mcgee_senior_thesis_poster.pdf",
-    mime="application/pdf"
-)
-
-st.image('./media/images/dylan_mcgee_senior_thesis.png',  use_container_width="always")
+st.image(image_variant('dylan_mcgee_senior_thesis.png'),  use_container_width="always")
 
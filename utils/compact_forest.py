@@ -0,0 +1,174 @@
+# Compact, array-backed copy of a fitted random forest classifier
+# Convert a saved sklearn forest from the repo root:
+#   python -m utils.compact_forest media/model_registry/<version>/elite_pitch_random_forest.joblib
+##### Imports #####
+import argparse
+import os
+import struct
+import zipfile
+import joblib
+import numpy as np
+
+# Every tree's nodes are concatenated into flat arrays: the split feature
+# (-1 for leaves), the threshold, and the (left, right) children as global node
+# numbers. Leaves keep the tree's probability of the positive class in the
+# threshold slot and list themselves as both children, so a batch can step
+# every tree one level at a time until nothing moves. Impurities, sample
+# counts and the per-node class values are not needed to predict and are
+# dropped.
+ARRAYS = ['feature', 'threshold', 'children', 'roots', 'feature_names']
+
+
+##### Forest #####
+class CompactForest:
+    # Predicts like the RandomForestClassifier it was built from, with plain
+    # numpy over the flat node arrays (binary classifiers only)
+    def __init__(self, feature, threshold, children, roots, feature_names):
+        # plain ndarray views, still backed by the mapped file when loaded
+        # with mmap, skip np.memmap's overhead on every indexing call
+        self.feature = np.asarray(feature)
+        self.threshold = np.asarray(threshold)
+        self.children = np.asarray(children)
+        self.roots = np.asarray(roots)
+        self.feature_names_in_ = feature_names
+        self.n_features_in_ = len(feature_names)
+        self.n_jobs = 1
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in ARRAYS[:-1])
+
+    def apply(self, X):
+        # Leaf reached in every tree, shape (n_samples, n_trees)
+        X = np.asarray(X, dtype='float32')
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f'Expected {self.n_features_in_} features, got {X.shape}')
+        if np.isnan(X).any():
+            raise ValueError('Input contains NaN')
+
+        values = X.ravel()
+        children = self.children.reshape(-1)
+        n_trees = len(self.roots)
+        leaves = np.tile(self.roots, len(X))
+        # (sample, tree) pairs still descending, dropped once they hit a leaf
+        active = np.arange(len(leaves))
+        node = leaves.copy()
+        row_start = np.repeat(np.arange(len(X), dtype='int32') * X.shape[1], n_trees)
+        while len(active):
+            # a leaf's feature of -1 reads some other value, harmless as both
+            # of its children are itself
+            go_right = values[row_start + self.feature[node]] > self.threshold[node]
+            moved = children[2 * node + go_right]
+            leaves[active] = moved
+            descending = moved != node
+            active, node, row_start = active[descending], moved[descending], row_start[descending]
+        return leaves.reshape(len(X), n_trees)
+
+    def predict_proba(self, X):
+        proba = self.threshold[self.apply(X)].mean(axis=1, dtype='float64')
+        return np.column_stack([1 - proba, proba])
+
+    def predict(self, X):
+        return (self.predict_proba(X)[:, 1] > 0.5).astype('int64')
+
+    def save(self, path, compress=False):
+        # Uncompressed files are memory-mapped by load_compact_forest, the
+        # compressed ones are smaller to ship but read into memory
+        save = np.savez_compressed if compress else np.savez
+        tmp_path = f'{path}.tmp.npz'
+        save(tmp_path, **{name: np.asarray(getattr(self, name)) for name in ARRAYS[:-1]},
+             feature_names=np.asarray(self.feature_names_in_, dtype=str))
+        os.replace(tmp_path, path)
+
+
+def float32_floor(values):
+    # Largest float32 at or below each value. sklearn compares float32 inputs
+    # against float64 thresholds, and x <= t holds for a float32 x exactly when
+    # x <= float32_floor(t), so the narrowed trees split every input the same way.
+    narrowed = values.astype('float32')
+    above = narrowed > values
+    narrowed[above] = np.nextafter(narrowed[above], np.float32(-np.inf))
+    return narrowed
+
+
+def compact_forest(model):
+    if len(model.classes_) != 2:
+        raise ValueError('Only binary classifiers can be compacted')
+    features, thresholds, children, roots = [], [], [], []
+    offset = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        leaf = tree.children_left < 0
+        # class values are weighted fractions, normalized again as predict_proba does
+        proba = tree.value[:, 0, 1] / tree.value[:, 0, :].sum(axis=1)
+
+        features.append(np.where(leaf, -1, tree.feature).astype('int16'))
+        thresholds.append(np.where(leaf, proba.astype('float32'), float32_floor(tree.threshold)))
+        node = np.arange(offset, offset + tree.node_count)
+        children.append(np.column_stack([
+            np.where(leaf, node, tree.children_left + offset),
+            np.where(leaf, node, tree.children_right + offset),
+        ]).astype('int32'))
+        roots.append(offset)
+        offset += tree.node_count
+
+    feature_names = getattr(model, 'feature_names_in_', None)
+    if feature_names is None:
+        feature_names = [f'x{i}' for i in range(model.n_features_in_)]
+    return CompactForest(
+        np.concatenate(features),
+        np.concatenate(thresholds).astype('float32'),
+        np.concatenate(children),
+        np.asarray(roots, dtype='int32'),
+        np.asarray(feature_names, dtype=str),
+    )
+
+
+##### Loading #####
+def _mmap_member(path, info):
+    # An array stored without compression in the .npz is a plain .npy file
+    # inside the zip, so it can be mapped straight from disk
+    with open(path, 'rb') as f:
+        f.seek(info.header_offset)
+        local_header = f.read(30)
+        name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(f)
+        offset = f.tell()
+    if dtype.hasobject:
+        raise ValueError(f'{info.filename} holds Python objects and cannot be mapped')
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+def load_compact_forest(path):
+    arrays = {}
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')]
+            if info.compress_type == zipfile.ZIP_STORED:
+                arrays[name] = _mmap_member(path, info)
+            else:
+                with archive.open(info) as f:
+                    arrays[name] = np.lib.format.read_array(f)
+    missing = [name for name in ARRAYS if name not in arrays]
+    if missing:
+        raise ValueError(f'{path} is missing forest arrays: {missing}')
+    return CompactForest(*(arrays[name] for name in ARRAYS))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert a saved sklearn random forest to the compact format')
+    parser.add_argument('model_path', help='joblib file written by utils/models.py')
+    parser.add_argument('--output', default=None, help='Defaults to the model path with a .npz suffix')
+    parser.add_argument('--compress', action='store_true', help='Deflate the arrays, loads without mmap')
+    args = parser.parse_args()
+
+    model = joblib.load(args.model_path)
+    forest = compact_forest(model)
+    output = args.output or os.path.splitext(args.model_path)[0] + '.npz'
+    forest.save(output, compress=args.compress)
+    print(f'{len(forest.roots)} trees, {len(forest.feature)} nodes: '
+          f'{os.path.getsize(args.model_path) / 1024:.0f} KB -> {os.path.getsize(output) / 1024:.0f} KB ({output})')
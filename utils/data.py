@@ -0,0 +1,677 @@
+# Shared pitch data layer used by the site pages and the model scripts
+##### Imports #####
+import argparse
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.fs as pafs
+from collections import OrderedDict
+
+MOVEMENT_PATH = './data/pitch_movement.csv'
+STATS_PATH = './data/pitch-arsenal-stats.csv'
+STORE_DIR = './data/store/pitch_data'
+MANIFEST_PATH = './data/store/manifest.json'
+
+# every file the loaded dataset can depend on, see season_paths() for the
+# files a single season depends on
+SOURCE_PATHS = [MOVEMENT_PATH, STATS_PATH, MANIFEST_PATH]
+
+MOVEMENT_COLUMNS = [
+    'year',
+    'pitcher_name',
+    'pitcher_id',
+    'team_name_abbrev',
+    'pitch_hand',
+    'pitch_type',
+    'pitch_type_name',
+    'avg_speed',
+    'pitches_thrown',
+    'total_pitches',
+    'pitch_per',
+    'pitcher_break_z',
+    'pitcher_break_z_induced',
+    'pitcher_break_x',
+    'pitch_key'
+]
+
+STATS_COLUMNS = [
+    'ba',
+    'slg',
+    'woba',
+    'whiff_percent',
+    'k_percent',
+    'put_away',
+    'est_ba',
+    'est_slg',
+    'est_woba',
+    'hard_hit_percent',
+    'year',
+    'pitch_key'
+]
+
+# Movement and performance metrics scored against the other pitches of the
+# same type and season (see pitch_type_scores). Breaks are scored by their
+# size, so a curveball's drop and a four-seamer's rise both count as more.
+SCORED_METRICS = [
+    'avg_speed',
+    'pitcher_break_z',
+    'pitcher_break_z_induced',
+    'pitcher_break_x',
+    'ba',
+    'slg',
+    'woba',
+    'whiff_percent',
+    'k_percent',
+    'put_away',
+    'est_ba',
+    'est_slg',
+    'est_woba',
+    'hard_hit_percent'
+]
+BREAK_METRICS = ['pitcher_break_z', 'pitcher_break_z_induced', 'pitcher_break_x']
+SCORE_SUFFIXES = ['pct', 'z', 'mad_z']
+SCORE_COLUMNS = [f'{metric}_{suffix}' for metric in SCORED_METRICS for suffix in SCORE_SUFFIXES]
+UPPER_QUARTILE = 0.75
+DERIVED_COLUMNS = SCORE_COLUMNS + ['upper_quartile_breaks']
+
+# columns of the exports, and of the stored dataset which adds the scores
+EXPORT_COLUMNS = MOVEMENT_COLUMNS + [column for column in STATS_COLUMNS if column not in MOVEMENT_COLUMNS]
+PITCH_DATA_COLUMNS = EXPORT_COLUMNS + DERIVED_COLUMNS
+
+# Statcast pitch type codes. A pitch type's position in this list is the code
+# packed into pitch_key, so new types must be appended, never reordered.
+PITCH_TYPES = [
+    'FF', 'SI', 'FC', 'SL', 'ST', 'SV', 'CU', 'KC', 'CS',
+    'CH', 'FS', 'FO', 'SC', 'KN', 'EP', 'FA', 'PO'
+]
+PITCH_TYPE_DTYPE = pd.CategoricalDtype(PITCH_TYPES)
+
+# Column types for the merged dataset. The CSVs store numbers as quoted
+# strings, so pinning the types here skips pandas' inference and keeps the
+# frame small enough to memory-map from the snapshot.
+CATEGORICAL_COLUMNS = ['team_name_abbrev', 'pitch_hand', 'pitch_type_name']
+
+INTEGER_COLUMNS = ['year', 'pitcher_id', 'pitches_thrown', 'total_pitches']
+
+FLOAT_COLUMNS = [
+    'avg_speed',
+    'pitch_per',
+    'pitcher_break_z',
+    'pitcher_break_z_induced',
+    'pitcher_break_x',
+    'ba',
+    'slg',
+    'woba',
+    'whiff_percent',
+    'k_percent',
+    'put_away',
+    'est_ba',
+    'est_slg',
+    'est_woba',
+    'hard_hit_percent'
+]
+
+
+##### Process Cache #####
+# Loaded frames shared by every session in the process, keyed on the request
+# (seasons and filters) plus the mtime and size of the files they came from so
+# a rebuilt store or replaced CSV is picked up without a restart. Least
+# recently used entries are dropped past CACHE_SIZE. Values are built outside
+# the cache lock, so a slow build only holds up sessions waiting on that same
+# value.
+CACHE_SIZE = 32
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+# one lock per key being built, so concurrent misses build it once
+_build_locks = {}
+
+
+def _file_signature(path):
+    if not os.path.exists(path):
+        return (path, None)
+    stat = os.stat(path)
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+
+def _shared(value):
+    # Frames are handed out as copies a caller can modify without changing
+    # the cached one: shallow under pandas copy-on-write (set by app.py), deep
+    # otherwise. Other values (indexes, fitted models) are shared as-is and
+    # must not be mutated.
+    if isinstance(value, pd.DataFrame):
+        return value.copy(deep=not pd.get_option('mode.copy_on_write'))
+    return value
+
+
+def _cache_hit(key):
+    # call with _cache_lock held
+    if key in _cache:
+        _cache.move_to_end(key)
+        return True
+    return False
+
+
+def cached(name, paths, build):
+    # Returns build() from the process cache, rebuilding once any of paths
+    # changes
+    key = (name,) + tuple(_file_signature(path) for path in paths)
+    with _cache_lock:
+        if _cache_hit(key):
+            return _shared(_cache[key])
+        build_lock = _build_locks.setdefault(key, threading.Lock())
+
+    with build_lock:
+        with _cache_lock:
+            if _cache_hit(key):
+                return _shared(_cache[key])
+        try:
+            value = build()
+            with _cache_lock:
+                for stale_key in [k for k in _cache if k[0] == name]:
+                    del _cache[stale_key]
+                _cache[key] = value
+                while len(_cache) > CACHE_SIZE:
+                    _cache.popitem(last=False)
+        finally:
+            with _cache_lock:
+                _build_locks.pop(key, None)
+    return _shared(value)
+
+
+def season_paths(seasons=None):
+    # Files the given seasons are loaded from, used to key derived caches so
+    # an ingest into one season leaves every other season's entries in place.
+    # All seasons also depend on the manifest, which lists them.
+    if seasons is None:
+        return SOURCE_PATHS + [_partition_path(year) for year in available_seasons()]
+    return [MOVEMENT_PATH, STATS_PATH] + [_partition_path(year) for year in sorted(seasons)]
+
+
+def dataset_version(seasons=None):
+    # Changes whenever any file the seasons are loaded from changes
+    return tuple(_file_signature(path) for path in season_paths(seasons))
+
+
+##### Join Key #####
+def pitch_key(pitcher_id, pitch_type):
+    # Packs a pitcher id and pitch type into one int64 (id in the high bits,
+    # pitch type code in the low byte) so movement and arsenal stats join on
+    # integers instead of per-row strings
+    codes = pd.Categorical(pitch_type, dtype=PITCH_TYPE_DTYPE).codes
+    if (codes < 0).any():
+        unknown = sorted(set(pd.Series(pitch_type)[codes < 0]))
+        raise ValueError(f'Unknown pitch types {unknown}, add them to PITCH_TYPES')
+    return (np.asarray(pitcher_id, dtype='int64') << 8) | codes
+
+
+##### CSV Loading #####
+def _read_movement(path):
+    # incomplete rows are dropped before the key is built from them
+    df = pd.read_csv(path, encoding='utf-8-sig').dropna()
+    df['pitch_key'] = pitch_key(df['pitcher_id'], df['pitch_type'])
+    df = df.rename(columns={'last_name, first_name': 'pitcher_name'})
+    return df[MOVEMENT_COLUMNS]
+
+
+def _read_stats(path, years):
+    # rows without a pitcher or pitch type could never join, skip them
+    df = pd.read_csv(path, encoding='utf-8-sig').dropna(subset=['player_id', 'pitch_type'])
+    df['pitch_key'] = pitch_key(df['player_id'], df['pitch_type'])
+    # Arsenal exports are one season per file and usually carry no year
+    if 'year' not in df.columns:
+        if len(years) != 1:
+            raise ValueError(f'{path} has no year column, pass the season it covers')
+        df['year'] = years[0]
+    return df[STATS_COLUMNS]
+
+
+def _apply_dtypes(df):
+    # also types the movement or arsenal columns alone, see _read_exports
+    df = df.astype({column: 'category' for column in CATEGORICAL_COLUMNS if column in df.columns})
+    if 'pitch_type' in df.columns:
+        df = df.astype({'pitch_type': PITCH_TYPE_DTYPE})
+    df = df.astype({column: 'int32' for column in INTEGER_COLUMNS if column in df.columns})
+    return df.astype({column: 'float32' for column in FLOAT_COLUMNS + SCORE_COLUMNS if column in df.columns})
+
+
+##### Within Pitch Type Scores #####
+# Every metric is compared with the other pitches of the same type and
+# season in one grouped pass over all metrics at once:
+#   _pct    percentile rank within the type (0-1)
+#   _z      standard deviations from the type mean
+#   _mad_z  robust z-score, 0.6745 * (x - median) / MAD, NaN when the MAD is 0
+# They are computed when the dataset is built and stored with it, so pages
+# filter on them without any groupby at request time.
+def pitch_type_scores(df):
+    values = df[SCORED_METRICS].astype('float64')
+    values[BREAK_METRICS] = values[BREAK_METRICS].abs()
+    keys = [df['year'].to_numpy(), df['pitch_type'].to_numpy()]
+    grouped = values.groupby(keys, observed=True)
+
+    deviation = values - grouped.transform('median')
+    mad = deviation.abs().groupby(keys, observed=True).transform('median')
+    scores = {
+        'pct': grouped.rank(pct=True),
+        'z': (values - grouped.transform('mean')) / grouped.transform('std'),
+        'mad_z': 0.6745 * deviation / mad.where(mad > 0),
+    }
+
+    result = pd.DataFrame(
+        {f'{metric}_{suffix}': scores[suffix][metric].to_numpy() for metric in SCORED_METRICS for suffix in SCORE_SUFFIXES},
+        index=df.index
+    ).astype('float32')
+    result['upper_quartile_breaks'] = (
+        (result['pitcher_break_x_pct'] >= UPPER_QUARTILE) & (result['pitcher_break_z_induced_pct'] >= UPPER_QUARTILE)
+    )
+    return pd.concat([df, result], axis=1)
+
+
+def _read_exports(movement_path, stats_path, year=None):
+    # Typed movement and arsenal stats, not yet joined
+    df_movement = _read_movement(movement_path)
+    years = [year] if year is not None else sorted(df_movement['year'].unique())
+    return _apply_dtypes(df_movement), _apply_dtypes(_read_stats(stats_path, years))
+
+
+def _read_export(movement_path, stats_path, year=None):
+    # Typed movement left joined with arsenal stats, before scoring
+    df_movement, df_stats = _read_exports(movement_path, stats_path, year)
+    # left join on movement
+    df = df_movement.merge(
+        df_stats,
+        on=['year', 'pitch_key'],
+        how='left',
+        suffixes=('_movement', '_stats')
+    )
+    return _apply_dtypes(df)
+
+
+def read_csv_pitch_data(movement_path=MOVEMENT_PATH, stats_path=STATS_PATH, year=None):
+    return _apply_dtypes(pitch_type_scores(_read_export(movement_path, stats_path, year)))
+
+
+##### Season Store #####
+# The merged dataset as typed, uncompressed Feather files, one partition per
+# season (STORE_DIR/year=2025/part-0.feather), so a page or the model only
+# maps the seasons it asks for. The manifest lists the stored seasons and the
+# hashes of the CSVs in data/ at the last build. Once those CSVs change the
+# seasons they hold are read from them again until the store is rebuilt.
+PARTITIONING = ds.partitioning(pa.schema([('year', pa.int32())]), flavor='hive')
+
+
+def _file_sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _source_hashes():
+    return {os.path.basename(path): _file_sha256(path) for path in [MOVEMENT_PATH, STATS_PATH]}
+
+
+def _read_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return {'seasons': [], 'source_sha256': {}}
+    with open(MANIFEST_PATH, 'r') as f:
+        return json.load(f)
+
+
+def _write_manifest(manifest):
+    tmp_path = MANIFEST_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def _partition_path(year):
+    return os.path.join(STORE_DIR, f'year={year}', 'part-0.feather')
+
+
+def _write_partition(df, year):
+    path = _partition_path(year)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(df.drop(columns='year'), preserve_index=False)
+    # uncompressed so the partition can be memory-mapped without decoding
+    feather.write_feather(table, path + '.tmp', compression='uncompressed')
+    os.replace(path + '.tmp', path)
+
+
+def write_seasons(df, source_sha256=None):
+    # Replaces the stored partition of every season present in df
+    manifest = _read_manifest()
+    for year, df_year in df.groupby('year'):
+        _write_partition(df_year, int(year))
+    manifest['seasons'] = sorted(set(manifest['seasons']) | {int(year) for year in df['year'].unique()})
+    if source_sha256 is not None:
+        manifest['source_sha256'] = source_sha256
+    _write_manifest(manifest)
+    return manifest
+
+
+def build_store(movement_path=MOVEMENT_PATH, stats_path=STATS_PATH, year=None):
+    df = read_csv_pitch_data(movement_path, stats_path, year)
+    is_current_export = (movement_path, stats_path) == (MOVEMENT_PATH, STATS_PATH)
+    write_seasons(df, _source_hashes() if is_current_export else None)
+    return df
+
+
+def _filter_expression(seasons, pitch_types, pitch_hands):
+    expression = ds.field('year').isin(list(seasons))
+    if pitch_types is not None:
+        expression &= ds.field('pitch_type').isin(list(pitch_types))
+    if pitch_hands is not None:
+        expression &= ds.field('pitch_hand').isin(list(pitch_hands))
+    return expression
+
+
+def _read_store(seasons, pitch_types, pitch_hands):
+    paths = [_partition_path(year) for year in seasons]
+    dataset = ds.dataset(
+        paths,
+        format='feather',
+        partitioning=PARTITIONING,
+        partition_base_dir=STORE_DIR,
+        filesystem=pafs.LocalFileSystem(use_mmap=True)
+    )
+    table = dataset.to_table(filter=_filter_expression(seasons, pitch_types, pitch_hands))
+    return table.to_pandas(split_blocks=True)
+
+
+def _filter_frame(df, seasons, pitch_types, pitch_hands):
+    mask = df['year'].isin(seasons)
+    if pitch_types is not None:
+        mask &= df['pitch_type'].isin(pitch_types)
+    if pitch_hands is not None:
+        mask &= df['pitch_hand'].isin(pitch_hands)
+    return df[mask]
+
+
+##### Loading #####
+def _csv_pitch_data():
+    return cached('csv_pitch_data', [MOVEMENT_PATH, STATS_PATH], read_csv_pitch_data)
+
+
+def _build_pitch_data(seasons, pitch_types, pitch_hands):
+    manifest = _read_manifest()
+    stored_seasons = set(manifest['seasons'])
+    frames = []
+    if manifest['source_sha256'] != _source_hashes():
+        # store is stale for whatever seasons the CSVs in data/ now hold
+        df_csv = _csv_pitch_data()
+        csv_seasons = set(df_csv['year'].unique())
+        if seasons is None:
+            seasons = sorted(stored_seasons | csv_seasons)
+        frames.append(_filter_frame(df_csv, seasons, pitch_types, pitch_hands))
+        stored_seasons -= csv_seasons
+    if seasons is None:
+        seasons = sorted(stored_seasons)
+    store_seasons = [year for year in seasons if year in stored_seasons]
+    if store_seasons:
+        frames.append(_read_store(store_seasons, pitch_types, pitch_hands))
+    if not frames:
+        raise ValueError(f'No pitch data for seasons {list(seasons)}')
+    df = pd.concat(frames, ignore_index=True)
+    return _apply_dtypes(df[PITCH_DATA_COLUMNS])
+
+
+def _normalize(values):
+    if values is None:
+        return None
+    return tuple(sorted(set(values)))
+
+
+def load_pitch_data(seasons=None, pitch_types=None, pitch_hands=None):
+    # Cleaned pitch movement left joined with arsenal stats, one row per
+    # pitcher, pitch type and season. Only the requested seasons are read and
+    # the pitch type / hand filters are pushed down into the store scan.
+    # Defaults to every stored season.
+    seasons, pitch_types, pitch_hands = _normalize(seasons), _normalize(pitch_types), _normalize(pitch_hands)
+    name = ('pitch_data', seasons, pitch_types, pitch_hands)
+    return cached(
+        name,
+        season_paths(seasons),
+        lambda: _build_pitch_data(seasons, pitch_types, pitch_hands)
+    )
+
+
+def available_seasons():
+    manifest = _read_manifest()
+    return sorted(manifest['seasons'])
+
+
+##### Incremental Ingest #####
+# A new export is matched to the stored rows on (year, pitch_key), where
+# pitch_key packs (pitcher_id, pitch_type). The movement and arsenal exports
+# are compared with the stored columns they hold separately, so a pitch
+# missing from either export keeps its stored values for that export's
+# columns. New and changed rows are upserted into their season's partition;
+# rows missing from the export are kept, so a partial export is fine. New
+# pitches without an arsenal row get no stats, as in a full build. Only the
+# touched seasons are rewritten, and only the
+# (season, pitch type) groups with a changed row are rescored. Caches keyed on
+# season_paths() for other seasons are not invalidated.
+KEY_COLUMNS = ['year', 'pitch_key']
+MOVEMENT_VALUE_COLUMNS = [column for column in MOVEMENT_COLUMNS if column not in KEY_COLUMNS]
+STATS_VALUE_COLUMNS = [column for column in STATS_COLUMNS if column not in KEY_COLUMNS]
+
+
+def _comparable(df):
+    # categories can differ between frames, compare their values instead
+    return df.astype({column: 'object' for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)})
+
+
+def _changed_keys(export, stored, columns):
+    # Keys of the export rows whose columns differ from the stored row
+    existing = export.index[export.index.isin(stored.index)]
+    after, before = export.loc[existing, columns], stored.loc[existing, columns]
+    same = (after == before) | (after.isna() & before.isna())
+    return existing[~same.all(axis=1).to_numpy()]
+
+
+def diff_export(df_movement, df_stats, df_stored):
+    # Export rows split into inserted (new key in the movement export) and
+    # updated (a changed movement value or arsenal stat), as full rows with
+    # the stored values kept for the columns an export has no row for.
+    # Returns the number of stored or inserted keys in either export too.
+    movement = _comparable(df_movement[MOVEMENT_COLUMNS]).set_index(KEY_COLUMNS)
+    stats = _comparable(df_stats[STATS_COLUMNS]).set_index(KEY_COLUMNS)
+    stored = _comparable(df_stored[EXPORT_COLUMNS]).set_index(KEY_COLUMNS)
+
+    is_new = ~movement.index.isin(stored.index)
+    inserted = movement[is_new].join(stats, how='left')
+
+    changed = _changed_keys(movement, stored, MOVEMENT_VALUE_COLUMNS).union(
+        _changed_keys(stats, stored, STATS_VALUE_COLUMNS)
+    )
+    updated = stored.loc[changed].copy()
+    from_movement = changed[changed.isin(movement.index)]
+    updated.loc[from_movement, MOVEMENT_VALUE_COLUMNS] = movement.loc[from_movement, MOVEMENT_VALUE_COLUMNS]
+    from_stats = changed[changed.isin(stats.index)]
+    updated.loc[from_stats, STATS_VALUE_COLUMNS] = stats.loc[from_stats, STATS_VALUE_COLUMNS]
+
+    # arsenal rows for pitches neither stored nor in the movement export are
+    # dropped, as the left join of a full build drops them
+    known = stored.index.union(movement.index)
+    exported = movement.index.union(stats.index[stats.index.isin(known)])
+    return (
+        inserted.reset_index()[EXPORT_COLUMNS],
+        updated.reset_index()[EXPORT_COLUMNS],
+        len(exported)
+    )
+
+
+def upsert_season(df_stored, inserted, updated):
+    # Stored rows with updated ones replaced in place and inserted ones
+    # appended. Scores carry over except for the pitch types that changed.
+    stored_keys = pd.MultiIndex.from_frame(df_stored[KEY_COLUMNS])
+    updated_keys = pd.MultiIndex.from_frame(updated[KEY_COLUMNS])
+    inserted_keys = pd.MultiIndex.from_frame(inserted[KEY_COLUMNS])
+    order = stored_keys.append(inserted_keys)
+
+    rows = pd.concat([df_stored[~stored_keys.isin(updated_keys)], updated, inserted])[EXPORT_COLUMNS]
+    rows.index = pd.MultiIndex.from_frame(rows[KEY_COLUMNS])
+    df = _apply_dtypes(rows.loc[order].reset_index(drop=True))
+
+    scores = df_stored[DERIVED_COLUMNS].set_axis(stored_keys).reindex(order).reset_index(drop=True)
+    changed_types = set(inserted['pitch_type']) | set(updated['pitch_type'])
+    touched = df['pitch_type'].isin(changed_types).to_numpy()
+    rescored = pitch_type_scores(df[touched])
+    for column in DERIVED_COLUMNS:
+        scores.loc[touched, column] = rescored[column].to_numpy()
+
+    df = pd.concat([df, scores.astype({'upper_quartile_breaks': bool})], axis=1)
+    return _apply_dtypes(df[PITCH_DATA_COLUMNS]), sorted(changed_types)
+
+
+def ingest(movement_path, stats_path, year=None):
+    # Upserts a new export into the store, returns a summary per season
+    manifest = _read_manifest()
+    if manifest['source_sha256'] and manifest['source_sha256'] != _source_hashes():
+        print('Warning: the CSVs in data/ changed since the last build, their seasons are read from them until you run build')
+    df_movement, df_stats = _read_exports(movement_path, stats_path, year)
+    summary = {}
+    for season, df_season in df_movement.groupby('year'):
+        season = int(season)
+        if season in manifest['seasons']:
+            df_stored = _apply_dtypes(_read_store([season], None, None)[PITCH_DATA_COLUMNS])
+        else:
+            df_stored = df_season.iloc[:0].reindex(columns=PITCH_DATA_COLUMNS)
+        inserted, updated, exported = diff_export(df_season, df_stats[df_stats['year'] == season], df_stored)
+        summary[season] = {
+            'inserted': len(inserted),
+            'updated': len(updated),
+            'unchanged': exported - len(inserted) - len(updated)
+        }
+        if len(inserted) or len(updated):
+            df, rescored = upsert_season(df_stored, inserted, updated)
+            _write_partition(df, season)
+            summary[season]['rescored_pitch_types'] = rescored
+    new_seasons = sorted(set(manifest['seasons']) | set(summary))
+    if new_seasons != manifest['seasons']:
+        # the manifest only changes when a season is added, so loads of other
+        # seasons stay cached
+        manifest['seasons'] = new_seasons
+        _write_manifest(manifest)
+    return summary
+
+
+##### Ingest Check #####
+# python -m utils.data check
+# Ingests partial exports into a scratch store built from the CSVs in data/
+# and compares the result with a full build. The real store is not touched.
+def _scratch_csv(df, directory, name):
+    path = os.path.join(directory, name)
+    df.to_csv(path, index=False)
+    return path
+
+
+def check_ingest():
+    # Returns a list of problems, empty when every case matches
+    import tempfile
+    global STORE_DIR, MANIFEST_PATH
+
+    movement = pd.read_csv(MOVEMENT_PATH, encoding='utf-8-sig').dropna()
+    stats = pd.read_csv(STATS_PATH, encoding='utf-8-sig')
+    year = int(movement['year'].iloc[0])
+    movement = movement[movement['year'] == year]
+    movement_keys = pitch_key(movement['pitcher_id'], movement['pitch_type'])
+    stats_keys = pitch_key(stats['player_id'], stats['pitch_type'])
+    expected = read_csv_pitch_data(MOVEMENT_PATH, STATS_PATH, year)
+    expected = expected[expected['year'] == year]
+
+    # 2 pitches left out of the scratch build and 5 with arsenal stats that
+    # are changed in it, both fixed by the partial export
+    with_stats = np.isin(movement_keys, stats_keys)
+    new_rows = movement[~with_stats].index[:2]
+    changed_rows = movement[with_stats].index[:5]
+    changed_stats = np.isin(stats_keys, movement_keys[movement.index.isin(changed_rows)])
+    stale_stats = stats.copy()
+    stale_stats.loc[changed_stats, 'est_slg'] += 0.05
+
+    # existing pitches with no arsenal row in the export, one with a changed
+    # speed, must keep their stored stats
+    kept_rows = movement[with_stats].index[5:8]
+    sped_up = movement.loc[kept_rows].copy()
+    sped_up.loc[kept_rows[0], 'avg_speed'] += 1
+
+    cases = [
+        ('partial export', movement.loc[new_rows.union(changed_rows)], stats[changed_stats],
+         {'inserted': 2, 'updated': 5}, expected),
+        ('no arsenal rows', movement.loc[kept_rows], stats.iloc[:0],
+         {'inserted': 0, 'updated': 0}, expected),
+        ('changed movement, no arsenal rows', sped_up, stats.iloc[:0],
+         {'inserted': 0, 'updated': 1}, None),
+    ]
+
+    problems = []
+    store_dir, manifest_path = STORE_DIR, MANIFEST_PATH
+    with tempfile.TemporaryDirectory() as directory:
+        STORE_DIR = os.path.join(directory, 'pitch_data')
+        MANIFEST_PATH = os.path.join(directory, 'manifest.json')
+        try:
+            build_store(
+                _scratch_csv(movement.drop(new_rows), directory, 'movement.csv'),
+                _scratch_csv(stale_stats, directory, 'stats.csv'),
+                year
+            )
+            for name, df_movement, df_stats, counts, df_expected in cases:
+                summary = ingest(
+                    _scratch_csv(df_movement, directory, 'movement_export.csv'),
+                    _scratch_csv(df_stats, directory, 'stats_export.csv'),
+                    year
+                )[year]
+                changes = {change: summary[change] for change in counts}
+                if changes != counts:
+                    problems.append(f'{name}: expected {counts}, got {changes}')
+                df_stored = _read_store([year], None, None)
+                exported_keys = pitch_key(df_movement['pitcher_id'], df_movement['pitch_type'])
+                stored_stats = df_stored[df_stored['pitch_key'].isin(exported_keys[np.isin(exported_keys, stats_keys)])]
+                if stored_stats[STATS_VALUE_COLUMNS].isna().all(axis=1).any():
+                    problems.append(f'{name}: stored stats were cleared')
+                if df_expected is not None:
+                    try:
+                        pd.testing.assert_frame_equal(
+                            _comparable(df_stored[PITCH_DATA_COLUMNS]).sort_values(KEY_COLUMNS).reset_index(drop=True),
+                            _comparable(df_expected[PITCH_DATA_COLUMNS]).sort_values(KEY_COLUMNS).reset_index(drop=True),
+                            check_dtype=False
+                        )
+                    except AssertionError as error:
+                        lines = str(error).splitlines()
+                        problems.append(f'{name}: store differs from a full build, {lines[0]} {lines[-1]}')
+        finally:
+            STORE_DIR, MANIFEST_PATH = store_dir, manifest_path
+    return problems
+
+
+##### Build Step #####
+# python -m utils.data build
+# python -m utils.data build --movement exports/pitch_movement_2024.csv --stats exports/pitch-arsenal-stats_2024.csv --year 2024
+# python -m utils.data ingest --movement exports/pitch_movement_daily.csv --stats exports/pitch-arsenal-stats_daily.csv --year 2025
+# python -m utils.data check
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or update the season-partitioned pitch data store')
+    parser.add_argument('command', choices=['build', 'ingest', 'check'])
+    parser.add_argument('--movement', default=MOVEMENT_PATH, help='Statcast pitch movement export')
+    parser.add_argument('--stats', default=STATS_PATH, help='Statcast pitch arsenal stats export')
+    parser.add_argument('--year', type=int, default=None, help='Season of the arsenal export if it has no year column')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        df = build_store(args.movement, args.stats, args.year)
+        for year, count in df['year'].value_counts().sort_index().items():
+            print(f'Wrote {count} rows for {year} to {_partition_path(year)}')
+    elif args.command == 'ingest':
+        for year, changes in ingest(args.movement, args.stats, args.year).items():
+            print(f'{year}: {changes}')
+    else:
+        problems = check_ingest()
+        for problem in problems:
+            print(f'mismatch: {problem}')
+        print('ingest matches a full build' if not problems else f'{len(problems)} problems')
+        raise SystemExit(1 if problems else 0)
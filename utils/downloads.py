@@ -0,0 +1,50 @@
+# PDF downloads shared by every session
+##### Imports #####
+import os
+import re
+import streamlit as st
+from utils.data import cached
+
+PDF_DIR = 'media/pdf'
+
+# dated resumes, e.g. dylan_mcgee_resume_20251120.pdf
+RESUME_PATTERN = re.compile(r'^dylan_mcgee_resume_(\d{8})\.pdf$')
+
+
+##### Files #####
+# st.download_button needs the file's bytes on every run. They are read once
+# per process and kept until the file changes, and every session is handed
+# the same bytes object. Streamlit's media storage keys files on their
+# content, so all sessions also share a single stored copy. A rerun only
+# stats the file.
+def file_bytes(path):
+    def read():
+        with open(path, 'rb') as f:
+            return f.read()
+    return cached(('file_bytes', path), [path], read)
+
+
+def latest_resume(directory=PDF_DIR):
+    # Newest dated resume, re-listed only when a file is added to or removed
+    # from the directory
+    def find():
+        dated = [
+            (match.group(1), name) for name in os.listdir(directory)
+            if (match := RESUME_PATTERN.match(name))
+        ]
+        if not dated:
+            raise FileNotFoundError(f'No dated resume in {directory}')
+        return os.path.join(directory, max(dated)[1])
+    return cached(('latest_resume', directory), [directory], find)
+
+
+##### Widgets #####
+def pdf_download_button(label, path, **kwargs):
+    # Download button for a PDF, saved under the file's own name
+    return st.download_button(
+        label=label,
+        data=file_bytes(path),
+        file_name=os.path.basename(path),
+        mime='application/pdf',
+        **kwargs
+    )
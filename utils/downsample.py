@@ -0,0 +1,48 @@
+# Server-side binning for scatter plots with too many points to draw
+##### Imports #####
+import numpy as np
+import pandas as pd
+
+
+##### Hexbin #####
+def hexbin(x, y, gridsize=40):
+    # Assigns every point to a hexagon on the same grid matplotlib's hexbin
+    # uses: two offset rectangular lattices, each point goes to the nearer
+    # center. Returns the bin centers, their counts and each point's bin.
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    nx = gridsize
+    ny = max(int(nx / np.sqrt(3)), 1)
+    x_min, x_max = x.min(), x.max()
+    y_min, y_max = y.min(), y.max()
+    sx = (x_max - x_min) / nx or 1.0
+    sy = (y_max - y_min) / ny or 1.0
+
+    ix = (x - x_min) / sx
+    iy = (y - y_min) / sy
+    ix1, iy1 = np.round(ix), np.round(iy)
+    ix2, iy2 = np.floor(ix), np.floor(iy)
+    d1 = (ix - ix1) ** 2 + 3 * (iy - iy1) ** 2
+    d2 = (ix - ix2 - 0.5) ** 2 + 3 * (iy - iy2 - 0.5) ** 2
+    on_first = d1 < d2
+
+    # lattice coordinates in half-cell units so both lattices share one id space
+    cx = np.where(on_first, 2 * ix1, 2 * ix2 + 1).astype('int64')
+    cy = np.where(on_first, 2 * iy1, 2 * iy2 + 1).astype('int64')
+    bin_ids, point_bins, counts = np.unique(
+        cx * (2 * ny + 4) + cy, return_inverse=True, return_counts=True
+    )
+    bin_cx, bin_cy = np.divmod(bin_ids, 2 * ny + 4)
+    centers_x = x_min + bin_cx * sx / 2
+    centers_y = y_min + bin_cy * sy / 2
+    return centers_x, centers_y, counts, point_bins
+
+
+def density_with_outliers(df, x, y, gridsize=40, max_outlier_count=2):
+    # Splits df into hexbin densities for crowded regions and the rows that
+    # sit in sparse bins, which are kept as individual points
+    centers_x, centers_y, counts, point_bins = hexbin(df[x], df[y], gridsize)
+    is_outlier = counts[point_bins] <= max_outlier_count
+    dense = counts > max_outlier_count
+    bins = pd.DataFrame({x: centers_x[dense], y: centers_y[dense], 'count': counts[dense]})
+    return bins, df[is_outlier]
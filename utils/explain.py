@@ -0,0 +1,119 @@
+# Per-pitch feature attributions for the elite pitch random forest
+# Written next to each registry version by utils/models.py, or run from the
+# repo root for an existing version:
+#   python -m utils.explain                 # active version
+#   python -m utils.explain --version 20251018-152500-1a2b3c
+##### Imports #####
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from scipy import sparse
+from utils.data import cached, load_pitch_data
+from utils.inference import PREPROCESSING_FILE, load_scorer
+from utils.registry import active_version, artifact_path, read_metadata
+
+ATTRIBUTIONS_FILE = 'pitch_attributions.feather'
+SKLEARN_MODEL_FILE = 'elite_pitch_random_forest.joblib'
+
+
+##### Path Attributions #####
+# Every split along a pitch's path through a tree moves the predicted elite
+# probability from the parent node's value to the child's. Crediting that
+# change to the parent's split feature and averaging over the trees splits
+# the forest's prediction into its prior (the root value, near 50% with
+# balanced class weights) plus one contribution per feature
+# (Saabas path attributions, the fast path-based cousin of TreeSHAP).
+def _node_deltas(model):
+    # Sparse (forest node x feature) matrix of the value change entering each
+    # node, scaled by 1/n_trees, and the forest's mean root value
+    rows, cols, deltas = [], [], []
+    bias = 0.0
+    offset = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        value = tree.value[:, 0, 1] / tree.value[:, 0, :].sum(axis=1)
+        internal = np.flatnonzero(tree.children_left >= 0)
+        parent = np.full(tree.node_count, -1)
+        parent[tree.children_left[internal]] = internal
+        parent[tree.children_right[internal]] = internal
+        child = np.flatnonzero(parent >= 0)
+
+        rows.append(child + offset)
+        cols.append(tree.feature[parent[child]])
+        deltas.append(value[child] - value[parent[child]])
+        bias += value[0]
+        offset += tree.node_count
+
+    n_trees = len(model.estimators_)
+    deltas = sparse.csr_matrix(
+        (np.concatenate(deltas) / n_trees, (np.concatenate(rows), np.concatenate(cols))),
+        shape=(offset, model.n_features_in_)
+    )
+    return deltas, bias / n_trees
+
+
+def path_attributions(model, X):
+    # Contributions of shape (n_samples, n_features) and the shared prior.
+    # base + contributions.sum(axis=1) equals predict_proba(X)[:, 1].
+    deltas, bias = _node_deltas(model)
+    # one sparse row per pitch marking every node it visits in every tree
+    paths, _ = model.decision_path(X)
+    return (paths @ deltas).toarray(), bias
+
+
+def build_attributions(version=None, seasons=None):
+    # Attributions for every scorable pitch, by default of the seasons the
+    # version was trained on
+    version = version or active_version()
+    seasons = seasons or read_metadata(version)['seasons']
+    scorer = load_scorer(
+        artifact_path(SKLEARN_MODEL_FILE, version),
+        artifact_path(PREPROCESSING_FILE, version)
+    )
+    df = load_pitch_data(seasons).dropna(subset=scorer.input_features)
+    contributions, bias = path_attributions(scorer.model, scorer.transform(df))
+
+    attributions = pd.DataFrame(contributions.astype('float32'), columns=scorer.feature_columns)
+    attributions.insert(0, 'year', df['year'].to_numpy())
+    attributions.insert(1, 'pitch_key', df['pitch_key'].to_numpy())
+    attributions['base'] = np.float32(bias)
+    return attributions
+
+
+def write_attributions(attributions, version):
+    table = pa.Table.from_pandas(attributions, preserve_index=False)
+    feather.write_feather(table, artifact_path(ATTRIBUTIONS_FILE, version), compression='uncompressed')
+
+
+##### Lookup #####
+def load_attributions(version=None):
+    # Indexed by (year, pitch_key), read once per model version
+    path = artifact_path(ATTRIBUTIONS_FILE, version)
+
+    def read():
+        return feather.read_table(path, memory_map=True).to_pandas().set_index(['year', 'pitch_key'])
+    return cached(('attributions', path), [path], read)
+
+
+def pitch_attribution(year, pitch_key, version=None):
+    # Prior and feature contributions for one pitch, largest effect
+    # first, or None if the pitch was not scored
+    attributions = load_attributions(version)
+    if (year, pitch_key) not in attributions.index:
+        return None
+    row = attributions.loc[(year, pitch_key)]
+    contributions = row.drop('base')
+    return row['base'], contributions.reindex(contributions.abs().sort_values(ascending=False).index)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute per-pitch feature attributions for a model version')
+    parser.add_argument('--version', default=None, help='Registry version, defaults to the active one')
+    args = parser.parse_args()
+
+    version = args.version or active_version()
+    attributions = build_attributions(version)
+    write_attributions(attributions, version)
+    print(f'{len(attributions)} pitches explained for {version}')
@@ -0,0 +1,81 @@
+# Process-wide cache of serialized Plotly figures
+##### Imports #####
+import gzip
+import json
+import threading
+from collections import OrderedDict
+from utils.data import cached, dataset_version
+
+# Total size of cached figure JSON, least recently used figures are evicted first
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+
+##### Cache #####
+# Figures are stored as the JSON spec the browser receives, keyed on the
+# chart name, the normalized filter state and the version of the seasons
+# drawn (all seasons when not given). Any
+# session asking for a view that has been drawn before gets the spec back
+# without running Plotly at all.
+_figures = OrderedDict()
+_figures_bytes = 0
+_figures_lock = threading.Lock()
+
+
+def normalize(values):
+    # Widget selections in a stable, hashable order
+    if values is None:
+        return None
+    return tuple(sorted(values))
+
+
+def _evict():
+    global _figures_bytes
+    while _figures_bytes > MAX_CACHE_BYTES and len(_figures) > 1:
+        _, spec = _figures.popitem(last=False)
+        _figures_bytes -= len(spec)
+
+
+def figure_json(name, filters, build, seasons=None):
+    # build() returns a plotly figure, only called on a cache miss
+    global _figures_bytes
+    key = (name, filters, dataset_version(seasons))
+    with _figures_lock:
+        if key in _figures:
+            _figures.move_to_end(key)
+            return _figures[key]
+
+    spec = build().to_json(validate=False)
+
+    with _figures_lock:
+        if key not in _figures:
+            _figures[key] = spec
+            _figures_bytes += len(spec)
+            _evict()
+    return spec
+
+
+##### Saved Figures #####
+# Model result figures are stored as the plain figure JSON from fig.to_json(),
+# gzip compressed when the path ends in .gz. The page sends that text to the
+# browser as-is, so showing a saved figure needs no parsing at all.
+def _open_figure_file(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def save_figure_json(fig, path):
+    with _open_figure_file(path, 'w') as f:
+        f.write(fig.to_json())
+
+
+def load_figure_json(path):
+    # Figure spec saved by utils/models.py, read once per file version
+    def read():
+        with _open_figure_file(path, 'r') as f:
+            spec = f.read()
+        # older artifacts hold the figure JSON wrapped in a JSON string
+        if spec.startswith('"'):
+            spec = json.loads(spec)
+        return spec
+    return cached(('figure_file', path), [path], read)
@@ -0,0 +1,109 @@
+# Precomputed filter index for the pitch movement explorer
+##### Imports #####
+import threading
+import numpy as np
+from collections import OrderedDict
+from utils.data import cached, load_pitch_data, season_paths
+
+
+##### Index #####
+# Widget changes only intersect prebuilt structures instead of rescanning
+# every column:
+#   - one packed bitmap per pitch type name and per pitch hand
+#   - avg_speed sorted once, so a speed range is two binary searches
+#   - pitcher name -> row positions
+#   - one packed bitmap of the pitches in the upper quartile of their type for
+#     both breaks, from the stored within-type percentiles
+# The rows of recent filter states are kept, so the chart and the pitch picker
+# share one lookup, and picker labels are built once for every row.
+ROWS_CACHE_SIZE = 64
+
+
+class PitchFilterIndex:
+    def __init__(self, df):
+        self.frame = df
+        self.n_rows = len(df)
+        self.labels = (
+            df['pitcher_name'].astype(str) + ' - ' + df['pitch_type_name'].astype(str)
+            + ' (' + df['year'].astype(str) + ')'
+        ).to_numpy()
+        self._rows_cache = OrderedDict()
+        self._rows_lock = threading.Lock()
+
+        self.pitch_type_bitmaps = self._bitmaps(df['pitch_type_name'])
+        self.pitch_hand_bitmaps = self._bitmaps(df['pitch_hand'])
+        self.upper_quartile_breaks_bitmap = np.packbits(df['upper_quartile_breaks'].to_numpy())
+
+        speed = df['avg_speed'].to_numpy()
+        self.speed_order = np.argsort(speed, kind='stable')
+        self.sorted_speed = speed[self.speed_order]
+
+        self.pitcher_rows = {
+            name: np.asarray(rows)
+            for name, rows in df.groupby('pitcher_name', observed=True).indices.items()
+        }
+
+    def _bitmaps(self, column):
+        return {
+            value: np.packbits(column.to_numpy() == value)
+            for value in column.unique()
+        }
+
+    def _rows_to_bitmap(self, rows):
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[rows] = True
+        return np.packbits(mask)
+
+    def _union(self, bitmaps, values):
+        result = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+        for value in values:
+            if value in bitmaps:
+                result |= bitmaps[value]
+        return result
+
+    def speed_rows(self, min_speed, max_speed):
+        start = np.searchsorted(self.sorted_speed, min_speed, side='left')
+        stop = np.searchsorted(self.sorted_speed, max_speed, side='right')
+        return self.speed_order[start:stop]
+
+    def rows(self, pitch_types, pitch_hands, speed_range, pitchers=None, upper_quartile_breaks=False):
+        # Row positions matching every filter, in frame order. Treat as read-only,
+        # the same array is handed to every caller with these filters.
+        key = (
+            tuple(sorted(pitch_types)), tuple(sorted(pitch_hands)), tuple(speed_range),
+            tuple(sorted(pitchers or ())), bool(upper_quartile_breaks)
+        )
+        with self._rows_lock:
+            if key in self._rows_cache:
+                self._rows_cache.move_to_end(key)
+                return self._rows_cache[key]
+        rows = self._match(pitch_types, pitch_hands, speed_range, pitchers, upper_quartile_breaks)
+        with self._rows_lock:
+            self._rows_cache[key] = rows
+            while len(self._rows_cache) > ROWS_CACHE_SIZE:
+                self._rows_cache.popitem(last=False)
+        return rows
+
+    def _match(self, pitch_types, pitch_hands, speed_range, pitchers, upper_quartile_breaks):
+        bitmap = self._union(self.pitch_type_bitmaps, pitch_types)
+        bitmap &= self._union(self.pitch_hand_bitmaps, pitch_hands)
+        bitmap &= self._rows_to_bitmap(self.speed_rows(*speed_range))
+        if upper_quartile_breaks:
+            bitmap &= self.upper_quartile_breaks_bitmap
+        if pitchers:
+            pitcher_rows = [self.pitcher_rows[name] for name in pitchers if name in self.pitcher_rows]
+            bitmap &= self._rows_to_bitmap(np.concatenate(pitcher_rows) if pitcher_rows else [])
+        return np.flatnonzero(np.unpackbits(bitmap, count=self.n_rows))
+
+    def filter(self, pitch_types, pitch_hands, speed_range, pitchers=None, upper_quartile_breaks=False):
+        return self.frame.iloc[self.rows(pitch_types, pitch_hands, speed_range, pitchers, upper_quartile_breaks)]
+
+
+def load_filter_index(seasons=None):
+    # Built once per dataset version and shared across sessions
+    seasons = tuple(sorted(seasons)) if seasons is not None else None
+    return cached(
+        ('filter_index', seasons),
+        season_paths(seasons),
+        lambda: PitchFilterIndex(load_pitch_data(seasons))
+    )
@@ -0,0 +1,213 @@
+# Pre-resized image variants for the pages
+# Every st.image source is resized to twice the width it is shown at and saved
+# as WebP, or as PNG where WebP can't be built, listed in a manifest the pages
+# pick from. Rebuild
+# from the repo root after adding or replacing an image:
+#   python -m utils.images build
+#   python -m utils.images build --formats avif webp png
+##### Imports #####
+import argparse
+import hashlib
+import json
+import os
+from utils.data import cached
+
+IMAGE_DIR = 'media/images'
+VARIANT_DIR = os.path.join(IMAGE_DIR, 'variants')
+MANIFEST_PATH = os.path.join(VARIANT_DIR, 'manifest.json')
+
+# CSS width in pixels each source is displayed at. Columns and containers
+# that stretch an image are given their width in the default centered layout.
+DISPLAY_WIDTHS = {
+    # resume header, st.image(width=250)
+    'dylan_mcgee_profile_photo_cropped.png': 250,
+    # thesis poster, full content width
+    'dylan_mcgee_senior_thesis.png': 704,
+    # pfx analysis headshots, the 1/5 column of each write-up
+    'chirs_bassitt_headshot.png': 140,
+    'nick_martinez_headshot.png': 140,
+    # pfx analysis movement figures, full content width
+    'chris_bassitt_curveball_movement.png': 704,
+    'nick_martinez_changeup_movement.png': 704,
+}
+
+# Streamlit sends one file per st.image with no srcset or <picture>
+# negotiation, so only the 2x variant (sharp on phones and high density
+# screens) is ever served and it is the only one built
+DENSITY = 2
+
+# Tried in order and only the first one built is kept. The PNG is made only
+# when Pillow has no WebP support or the WebP copy is no smaller than the source.
+FORMATS = ['webp', 'png']
+
+# Served in this order when built
+PREFERRED_FORMATS = ['avif', 'webp', 'png']
+
+SAVE_OPTIONS = {
+    'avif': {'quality': 60},
+    'webp': {'quality': 82, 'method': 6},
+    'png': {'optimize': True},
+}
+
+
+##### Build #####
+def _source_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+def variant_width(display_width, source_width):
+    # Width to build, never upscaled past the source
+    return min(display_width * DENSITY, source_width)
+
+
+def build_variants(name, display_width, formats=FORMATS):
+    # Resized copy of one source image in the first of formats that beats the
+    # source, returns its manifest entry
+    from PIL import Image
+
+    path = os.path.join(IMAGE_DIR, name)
+    stem = os.path.splitext(name)[0]
+    with Image.open(path) as source:
+        source.load()
+        image = source
+        # an alpha channel that is fully opaque only costs bytes
+        if image.mode in ('RGBA', 'LA') and image.getchannel('A').getextrema()[0] == 255:
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+        variants = []
+        width = variant_width(display_width, image.width)
+        height = round(image.height * width / image.width)
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        for image_format in formats:
+            variant_path = os.path.join(VARIANT_DIR, f'{stem}-{width}w.{image_format}')
+            resized.save(variant_path, format=image_format.upper(), **SAVE_OPTIONS[image_format])
+            # a lossless copy at near full size can outweigh the source,
+            # which is then the better fallback
+            if os.path.getsize(variant_path) >= os.path.getsize(path):
+                os.remove(variant_path)
+                continue
+            variants.append({
+                'width': width,
+                'height': height,
+                'format': image_format,
+                'path': variant_path,
+                'bytes': os.path.getsize(variant_path),
+            })
+            break
+
+    return {
+        'source_hash': _source_hash(path),
+        'source_width': source.width,
+        'source_bytes': os.path.getsize(path),
+        'display_width': display_width,
+        'density': DENSITY,
+        'formats': list(formats),
+        'variants': variants,
+    }
+
+
+def supported_formats(formats):
+    from PIL import features
+    return [image_format for image_format in formats if image_format == 'png' or features.check(image_format)]
+
+
+def build_manifest(formats=FORMATS, force=False):
+    # Rebuilds only images whose source, display width, density or formats changed
+    formats = supported_formats(formats)
+    os.makedirs(VARIANT_DIR, exist_ok=True)
+    previous = read_manifest() if os.path.exists(MANIFEST_PATH) else {}
+
+    manifest = {}
+    for name, display_width in DISPLAY_WIDTHS.items():
+        entry = previous.get(name)
+        if (
+            not force and entry is not None
+            and entry['source_hash'] == _source_hash(os.path.join(IMAGE_DIR, name))
+            and entry['display_width'] == display_width
+            and entry.get('density') == DENSITY
+            and entry['formats'] == formats
+            and all(os.path.exists(variant['path']) for variant in entry['variants'])
+        ):
+            manifest[name] = entry
+        else:
+            manifest[name] = build_variants(name, display_width, formats)
+
+    # variants no longer listed are removed
+    keep = {variant['path'] for entry in manifest.values() for variant in entry['variants']}
+    for file_name in os.listdir(VARIANT_DIR):
+        path = os.path.join(VARIANT_DIR, file_name)
+        if path != MANIFEST_PATH and path not in keep:
+            os.remove(path)
+
+    with open(f'{MANIFEST_PATH}.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f'{MANIFEST_PATH}.tmp', MANIFEST_PATH)
+    return manifest
+
+
+##### Lookup #####
+def read_manifest():
+    def read():
+        with open(MANIFEST_PATH, 'r') as f:
+            return json.load(f)
+    return cached(('image_manifest', MANIFEST_PATH), [MANIFEST_PATH], read)
+
+
+def source_hash(name):
+    # Hash of a source image, recomputed only when the file changes
+    path = os.path.join(IMAGE_DIR, name)
+    return cached(('image_source_hash', path), [path], lambda: _source_hash(path))
+
+
+def is_stale(name, entry):
+    # The source was replaced since its variants were built
+    return os.path.exists(os.path.join(IMAGE_DIR, name)) and entry['source_hash'] != source_hash(name)
+
+
+def stale_images():
+    # Sources whose variants need a rebuild, served as the original until then
+    if not os.path.exists(MANIFEST_PATH):
+        return []
+    return [name for name, entry in read_manifest().items() if is_stale(name, entry)]
+
+
+def image_variant(name, width=None, density=2, formats=PREFERRED_FORMATS):
+    # Path of the smallest variant covering width CSS pixels (the image's
+    # display width by default) at the given screen density, in the first
+    # preferred format built. Falls back to the original image when it has
+    # no variants or they were built from an image since replaced.
+    original = os.path.join(IMAGE_DIR, name)
+    width = width or DISPLAY_WIDTHS.get(name, 0)
+    if not os.path.exists(MANIFEST_PATH):
+        return original
+    entry = read_manifest().get(name)
+    if entry is None or is_stale(name, entry):
+        return original
+
+    for image_format in formats:
+        variants = sorted(
+            (variant for variant in entry['variants'] if variant['format'] == image_format),
+            key=lambda variant: variant['width']
+        )
+        if variants:
+            covering = [variant for variant in variants if variant['width'] >= width * density]
+            return (covering[0] if covering else variants[-1])['path']
+    return original
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build resized image variants for the pages')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='Resize every listed image and write the manifest')
+    build_parser.add_argument('--formats', nargs='+', default=FORMATS, choices=sorted(SAVE_OPTIONS))
+    build_parser.add_argument('--force', action='store_true', help='Rebuild images that have not changed')
+    args = parser.parse_args()
+
+    manifest = build_manifest(args.formats, args.force)
+    for name, entry in manifest.items():
+        served = image_variant(name)
+        print(f"{name}: {entry['source_bytes'] / 1024:.0f} KB -> {os.path.getsize(served) / 1024:.0f} KB ({served})")
+    print(f'Manifest saved to {MANIFEST_PATH}')
@@ -0,0 +1,125 @@
+# Online scoring for the elite pitch classifier
+# Run from the repo root to check latency:
+#   python -m utils.inference bench
+##### Imports #####
+import argparse
+import time
+import joblib
+import numpy as np
+import pandas as pd
+from utils.compact_forest import load_compact_forest
+from utils.data import cached
+from utils.registry import artifact_path
+
+# files in each model registry version
+MODEL_FILE = 'elite_pitch_forest.npz'
+PREPROCESSING_FILE = 'preprocessing.joblib'
+
+# single pitch scoring budget checked by the benchmark
+P99_TARGET_MS = 25
+
+
+##### Scorer #####
+class PitchScorer:
+    # Applies the preprocessing saved by utils/models.py (standard scaling of
+    # the continuous features, one-hot pitch hand) with plain numpy and scores
+    # the result with the saved forest, compact or sklearn. Accepts a dict for
+    # one pitch, or a list of dicts / DataFrame for a batch.
+    def __init__(self, model, preprocessing):
+        self.model = model
+        # parallel prediction only pays off for large batches
+        self.model.n_jobs = 1
+        self.feature_columns = preprocessing['feature_columns']
+        if list(getattr(model, 'feature_names_in_', self.feature_columns)) != self.feature_columns:
+            raise ValueError('Preprocessing columns do not match the model features')
+        # transform() builds the matrix in that column order, so sklearn's
+        # per-call feature name check on DataFrames is not needed
+        if hasattr(model, 'feature_names_in_'):
+            del self.model.feature_names_in_
+        self.continuous_features = preprocessing['continuous_features']
+        self.mean = np.asarray(preprocessing['mean'], dtype='float64')
+        self.scale = np.asarray(preprocessing['scale'], dtype='float64')
+        self.dummy_columns = preprocessing['dummy_columns']
+        self.input_features = self.continuous_features + list(self.dummy_columns)
+
+        positions = {column: i for i, column in enumerate(self.feature_columns)}
+        self.continuous_positions = [positions[feature] for feature in self.continuous_features]
+        self.dummy_positions = [
+            (feature, value, positions[f'{feature}_{value}'])
+            for feature, values in self.dummy_columns.items()
+            for value in values
+        ]
+
+    def _frame(self, pitches):
+        if isinstance(pitches, dict):
+            pitches = [pitches]
+        df = pitches if isinstance(pitches, pd.DataFrame) else pd.DataFrame(pitches)
+        missing = [feature for feature in self.input_features if feature not in df.columns]
+        if missing:
+            raise ValueError(f'Missing pitch features: {missing}')
+        if df[self.input_features].isna().any().any():
+            raise ValueError('Pitch features cannot be missing')
+        return df
+
+    def transform(self, pitches):
+        df = self._frame(pitches)
+        X = np.zeros((len(df), len(self.feature_columns)), dtype='float32')
+        # rounded to float32 after each step, as StandardScaler does for the
+        # float32 training data, so split thresholds compare identically
+        continuous = df[self.continuous_features].to_numpy(dtype='float32')
+        centered = (continuous - self.mean).astype('float32')
+        X[:, self.continuous_positions] = centered / self.scale
+        for feature, value, position in self.dummy_positions:
+            X[:, position] = df[feature].to_numpy() == value
+        return X
+
+    def score(self, pitches):
+        # Probability each pitch is elite
+        return self.model.predict_proba(self.transform(pitches))[:, 1]
+
+
+def load_scorer(model_path=None, preprocessing_path=None):
+    # Defaults to the active registry version. Loaded once per artifact
+    # version and shared by every session, activating another model version
+    # changes the paths and so swaps the scorer on the next call. The
+    # compact forest's arrays are memory-mapped from the .npz file, so every
+    # worker process shares the same pages; a .joblib path loads the full
+    # sklearn forest instead.
+    model_path = model_path or artifact_path(MODEL_FILE)
+    preprocessing_path = preprocessing_path or artifact_path(PREPROCESSING_FILE)
+
+    def load():
+        if model_path.endswith('.joblib'):
+            model = joblib.load(model_path)
+        else:
+            model = load_compact_forest(model_path)
+        return PitchScorer(model, joblib.load(preprocessing_path))
+    return cached(('scorer', model_path, preprocessing_path), [model_path, preprocessing_path], load)
+
+
+##### Benchmark #####
+def latency_ms(score, pitches, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        score(pitches)
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.percentile(timings, [50, 99])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score pitches with the saved elite pitch model')
+    parser.add_argument('command', choices=['bench'])
+    parser.add_argument('--repeats', type=int, default=500)
+    args = parser.parse_args()
+
+    from utils.data import load_pitch_data
+
+    scorer = load_scorer()
+    df = load_pitch_data().dropna(subset=scorer.input_features)
+    single = df[scorer.input_features].iloc[0].to_dict()
+
+    p50, p99 = latency_ms(scorer.score, single, args.repeats)
+    print(f'single pitch: p50 {p50:.2f}ms  p99 {p99:.2f}ms  (target p99 {P99_TARGET_MS}ms)')
+    p50, p99 = latency_ms(scorer.score, df, max(args.repeats // 10, 10))
+    print(f'batch of {len(df)}: p50 {p50:.2f}ms  p99 {p99:.2f}ms')
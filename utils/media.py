@@ -0,0 +1,93 @@
+# Videos for the pages and a check that every media file they use exists
+# Run from the repo root before deploying:
+#   python -m utils.media check
+##### Imports #####
+import argparse
+import glob
+import logging
+import os
+import re
+import sys
+import streamlit as st
+from utils.data import cached
+from utils.downloads import PDF_DIR, RESUME_PATTERN, file_bytes
+from utils.images import DISPLAY_WIDTHS, IMAGE_DIR, MANIFEST_PATH, read_manifest, stale_images
+
+PAGE_SOURCES = ['app.py', 'pages/*.py', 'forms/*.py']
+
+# media paths written out in the page scripts, e.g. st.video('media/videos/x.mp4')
+MEDIA_LITERAL = re.compile(r"""['"](media/[^'"]+\.\w+)['"]""")
+
+_logger = logging.getLogger(__name__)
+
+
+##### Videos #####
+# Streamlit serves st.video through its media endpoint, which already gives
+# every file a content-hash URL and answers ETag revalidation and the range
+# requests browsers use to seek and stream. The bytes come from the process
+# cache, so a rerun no longer reads the file from disk, and every session
+# shares one stored copy.
+# Streamlit's own static folder is not used for video: it labels anything but
+# images, fonts, PDF, XML and JSON as text/plain with nosniff.
+def video(path):
+    # Missing videos get a placeholder instead of stopping the page
+    if not os.path.exists(path):
+        st.info(f'Video unavailable: {os.path.basename(path)}')
+        return
+    st.video(file_bytes(path), format='video/mp4')
+
+
+##### Check #####
+def referenced_media():
+    # Every media file the site needs: paths written in the page scripts,
+    # the sources and variants of the resized images, and a dated resume
+    paths = set()
+    for pattern in PAGE_SOURCES:
+        for source in glob.glob(pattern):
+            with open(source, 'r', encoding='utf-8') as f:
+                paths.update(MEDIA_LITERAL.findall(f.read()))
+
+    paths.update(os.path.join(IMAGE_DIR, name) for name in DISPLAY_WIDTHS)
+    if os.path.exists(MANIFEST_PATH):
+        paths.update(
+            variant['path'] for entry in read_manifest().values() for variant in entry['variants']
+        )
+    return sorted(paths)
+
+
+def missing_media():
+    missing = [path for path in referenced_media() if not os.path.exists(path)]
+    if not os.path.isdir(PDF_DIR) or not any(RESUME_PATTERN.match(name) for name in os.listdir(PDF_DIR)):
+        missing.append(os.path.join(PDF_DIR, 'dylan_mcgee_resume_YYYYMMDD.pdf'))
+    return missing
+
+
+def check_media():
+    # Logged once per process at startup, pages show placeholders for the
+    # missing files rather than failing partway through, and the originals of
+    # images with stale variants
+    def check():
+        missing = missing_media()
+        if missing:
+            _logger.warning('Missing media files: %s', ', '.join(missing))
+        stale = stale_images()
+        if stale:
+            _logger.warning('Images changed since their variants were built, run python -m utils.images build: %s', ', '.join(stale))
+        return missing
+    return cached(('missing_media',), [], check)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the media files used by the site')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('check', help='List missing media and stale image variants, exits 1 if any')
+    args = parser.parse_args()
+
+    missing = missing_media()
+    for path in missing:
+        print(f'missing: {path}')
+    stale = stale_images()
+    for name in stale:
+        print(f'stale variants: {name}, run python -m utils.images build')
+    print(f'{len(referenced_media())} media files referenced, {len(missing)} missing, {len(stale)} with stale variants')
+    sys.exit(1 if missing or stale else 0)
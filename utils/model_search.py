@@ -0,0 +1,234 @@
+# Hyperparameter search across model families for the elite pitch classifier
+# Run from the repo root:
+#   python -m utils.model_search                   # default grid, 10 minute budget
+#   python -m utils.model_search --time-budget 120 --workers 4
+##### Imports #####
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import queue
+import time
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import StratifiedKFold, train_test_split
+from utils import models
+from utils.data import cached
+from utils.registry import active_version, artifact_path, read_metadata
+
+# written into the registry version the search was run against
+LEADERBOARD_FILE = 'leaderboard.json'
+
+# family -> (estimator, parameter grid, fixed parameters)
+SEARCH_SPACE = {
+    'random_forest': (
+        RandomForestClassifier,
+        {'n_estimators': [100, 300], 'max_depth': [None, 6, 12], 'min_samples_leaf': [1, 3, 5]},
+        {'class_weight': 'balanced', 'random_state': models.RANDOM_STATE, 'n_jobs': 1},
+    ),
+    'gradient_boosting': (
+        GradientBoostingClassifier,
+        {'n_estimators': [100, 300], 'learning_rate': [0.03, 0.1], 'max_depth': [2, 3]},
+        {'random_state': models.RANDOM_STATE},
+    ),
+    'logistic_regression': (
+        LogisticRegression,
+        {'C': [0.01, 0.1, 1.0, 10.0]},
+        {'class_weight': 'balanced', 'max_iter': 1000},
+    ),
+}
+
+# Successive halving: every trial is first scored on a quarter of the
+# training rows, and only the best 1/ETA move on to the next, larger rung
+RUNG_FRACTIONS = [0.25, 0.5, 1.0]
+ETA = 2
+CV_FOLDS = 5
+
+
+def trials(search_space=SEARCH_SPACE):
+    for family, (_, grid, _) in search_space.items():
+        names = list(grid)
+        for values in itertools.product(*(grid[name] for name in names)):
+            yield family, dict(zip(names, values))
+
+
+def make_model(family, params):
+    estimator, _, fixed = SEARCH_SPACE[family]
+    return estimator(**fixed, **params)
+
+
+##### Workers #####
+# The training split is sent to each worker once, not with every trial
+_X_train = None
+_Y_train = None
+
+
+def _init_worker(X_train, Y_train):
+    global _X_train, _Y_train
+    _X_train, _Y_train = X_train, Y_train
+
+
+def score_trial(family, params, fraction):
+    # Mean cross-validated ROC AUC on a stratified sample of the training rows
+    X, Y = _X_train, _Y_train
+    if fraction < 1:
+        X, _, Y, _ = train_test_split(
+            X, Y, train_size=fraction, random_state=models.RANDOM_STATE, stratify=Y
+        )
+    folds = StratifiedKFold(n_splits=CV_FOLDS, shuffle=True, random_state=models.RANDOM_STATE)
+    start = time.perf_counter()
+    scores = []
+    for train_index, valid_index in folds.split(X, Y):
+        model = make_model(family, params)
+        model.fit(X.iloc[train_index], Y.iloc[train_index])
+        proba = model.predict_proba(X.iloc[valid_index])[:, 1]
+        scores.append(roc_auc_score(Y.iloc[valid_index], proba))
+    return {
+        'cv_auc': float(np.mean(scores)),
+        'cv_auc_std': float(np.std(scores)),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+##### Search #####
+# Trial status on the leaderboard:
+#   finished   scored on every rung
+#   pruned     dropped after scoring on its rung
+#   scored     scored on its rung, which the time budget cut short
+#   timed_out  still being scored on the next rung when time ran out
+def successive_halving(X_train, Y_train, time_budget=600, workers=None):
+    deadline = time.monotonic() + time_budget
+    board = [
+        {'family': family, 'params': params, 'status': 'running', 'rung': None}
+        for family, params in trials()
+    ]
+    survivors = list(range(len(board)))
+
+    # multiprocessing's pool rather than concurrent.futures, whose shutdown
+    # always waits for trials already running: terminate() stops the workers
+    # mid-trial, so the budget is a hard stop
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(X_train, Y_train))
+    try:
+        for rung, fraction in enumerate(RUNG_FRACTIONS):
+            completed = queue.Queue()
+            for i in survivors:
+                pool.apply_async(
+                    score_trial,
+                    (board[i]['family'], board[i]['params'], fraction),
+                    callback=lambda result, i=i: completed.put((i, result, None)),
+                    error_callback=lambda error, i=i: completed.put((i, None, error)),
+                )
+            pending = set(survivors)
+            while pending and time.monotonic() < deadline:
+                try:
+                    i, result, error = completed.get(timeout=deadline - time.monotonic())
+                except queue.Empty:
+                    break
+                if error is not None:
+                    raise error
+                pending.discard(i)
+                board[i].update(result, rung=rung, train_fraction=fraction, status='scored')
+
+            if pending:
+                for i in pending:
+                    board[i]['status'] = 'timed_out'
+                print(f'Time budget reached during rung {rung}')
+                break
+
+            scored = sorted(survivors, key=lambda i: board[i]['cv_auc'], reverse=True)
+            print(f'Rung {rung} ({fraction:.0%} of training rows): scored {len(scored)} trials')
+            if rung == len(RUNG_FRACTIONS) - 1:
+                for i in scored:
+                    board[i]['status'] = 'finished'
+                break
+            keep = max(math.ceil(len(scored) / ETA), 1)
+            for i in scored[keep:]:
+                board[i]['status'] = 'pruned'
+            survivors = scored[:keep]
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return board
+
+
+def test_best(board, X_train, Y_train, X_test, Y_test):
+    # Refit the best trial of each family on all training rows and score it
+    # on the held-out split used by the published model
+    ranked = [row for row in board if 'cv_auc' in row]
+    ranked.sort(key=lambda row: (row['rung'], row['cv_auc']), reverse=True)
+    for family in SEARCH_SPACE:
+        best = next((row for row in ranked if row['family'] == family), None)
+        if best is None:
+            continue
+        model = make_model(family, best['params']).fit(X_train, Y_train)
+        best['test_auc'] = float(roc_auc_score(Y_test, model.predict_proba(X_test)[:, 1]))
+    return ranked + [row for row in board if 'cv_auc' not in row]
+
+
+def write_leaderboard(board, version, **metadata):
+    with open(artifact_path(LEADERBOARD_FILE, version), 'w') as f:
+        json.dump({'metadata': {'model_version': version, **metadata}, 'trials': board}, f, indent=2, default=str)
+
+
+def load_leaderboard(version=None):
+    # Search run against a model version, the active one by default, read
+    # once per file version
+    path = artifact_path(LEADERBOARD_FILE, version)
+
+    def read():
+        with open(path, 'r') as f:
+            return json.load(f)
+    return cached(('leaderboard', path), [path], read)
+
+
+def leaderboard_frame(leaderboard):
+    # One row per trial, best first, for display on the site
+    df = pd.DataFrame(leaderboard['trials'])
+    df['params'] = df['params'].map(lambda params: ', '.join(f'{k}={v}' for k, v in params.items()))
+    columns = ['family', 'params', 'status', 'train_fraction', 'cv_auc', 'cv_auc_std', 'test_auc']
+    return df.reindex(columns=columns)
+
+
+def best_rung(df_leaderboard):
+    # Trials scored on the most training rows any trial reached, which is
+    # the full training split unless the time budget ran out first
+    return df_leaderboard[df_leaderboard['train_fraction'] == df_leaderboard['train_fraction'].max()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare model families for the elite pitch classifier')
+    parser.add_argument('--time-budget', type=float, default=600, help='Seconds before remaining trials are stopped')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes, defaults to all cores')
+    parser.add_argument('--version', default=None, help='Registry version to compare against, defaults to the active one')
+    args = parser.parse_args()
+
+    # same features and train/test split as utils/models.py, from its stage cache
+    version = args.version or active_version()
+    X, Y, scaler, splits, keys = models.prepare()
+    if read_metadata(version)['data_hash'] != keys['data']:
+        parser.error(f'{version} was trained on other data than the current store, retrain it first')
+    X_train, X_test, Y_train, Y_test = splits
+
+    start = time.perf_counter()
+    board = successive_halving(X_train, Y_train, args.time_budget, args.workers)
+    board = test_best(board, X_train, Y_train, X_test, Y_test)
+    print(leaderboard_frame({'trials': board}).head(10).to_string(index=False))
+    # a cut short run does not replace a completed search
+    if not any(row['status'] == 'finished' for row in board) and os.path.exists(artifact_path(LEADERBOARD_FILE, version)):
+        print(f'No trial finished every rung, kept the existing {artifact_path(LEADERBOARD_FILE, version)}')
+        raise SystemExit(1)
+    write_leaderboard(
+        board,
+        version,
+        seasons=models.SEASONS,
+        rung_fractions=RUNG_FRACTIONS,
+        cv_folds=CV_FOLDS,
+        seconds=round(time.perf_counter() - start, 1),
+    )
+    print(f'Leaderboard saved to {artifact_path(LEADERBOARD_FILE, version)}')
@@ -1,5 +1,15 @@
 # This script will be used to generate models to alter be referenced on the site
+# Run from the repo root:
+#   python -m utils.models                       # run the pipeline, reusing cached stages
+#   python -m utils.models --n-estimators 300    # only the fit stage onward reruns
+#   python -m utils.models --force               # ignore the stage cache
+#   python -m utils.models --no-activate         # register without switching the site
 ##### Imports #####
+import argparse
+import hashlib
+import os
+import time
+from datetime import datetime, timezone
 import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
@@ -7,76 +17,28 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import classification_report, confusion_matrix, roc_auc_score, roc_curve, auc
 from sklearn.preprocessing import StandardScaler
 import plotly.express as px
-import plotly.graph_objects as go 
+import plotly.graph_objects as go
 import joblib
-import json
+from utils import registry
+from utils.compact_forest import compact_forest
+from utils.data import load_pitch_data
+from utils.explain import ATTRIBUTIONS_FILE, build_attributions, write_attributions
+from utils.rankings import RANKINGS_FILE, build_rankings, write_rankings
+from utils.figure_cache import save_figure_json
 
-##### Data Cleaning, Merging #####
-df_pitch_movement = pd.read_csv('./data/pitch_movement.csv')
-df_pitch_stats = pd.read_csv('./data/pitch-arsenal-stats.csv')
-
-df_pitch_movement['pitcherId_pitchType'] = df_pitch_movement['pitcher_id'].astype(str) + '_' + df_pitch_movement['pitch_type']
-df_pitch_stats['pitcherId_pitchType'] = df_pitch_stats['player_id'].astype(str) + '_' + df_pitch_stats['pitch_type']
-df_pitch_movement = df_pitch_movement.dropna()
-df_pitch_movement.rename(columns={'last_name, first_name': 'pitcher_name'}, inplace=True)
-
-# filter data for relevant columns
-df_pitch_movement = df_pitch_movement[[
-    'pitcher_name',	
-    'pitcher_id',	
-    'team_name_abbrev',	
-    'pitch_hand',
-    'pitch_type',
-    'pitch_type_name',
-    'avg_speed',
-    'pitches_thrown',
-    'total_pitches',
-    'pitch_per',
-    'pitcher_break_z',
-    'pitcher_break_z_induced',
-    'pitcher_break_x',
-    'pitcherId_pitchType'
-]]
-
-df_pitch_stats = df_pitch_stats[[
-    'ba',	
-    'slg',	
-    'woba',	
-    'whiff_percent',	
-    'k_percent',	
-    'put_away',	
-    'est_ba',	
-    'est_slg',	
-    'est_woba',	
-    'hard_hit_percent',
-    'pitcherId_pitchType'
-]]
-
-
-# left join on movement
-df_merged = df_pitch_movement.merge(df_pitch_stats, on='pitcherId_pitchType', how='left', suffixes=('_movement', '_stats'))
 
+SEASONS = [2025]
 
 PERFORMANCE_METRIC = 'whiff_percent'
 
-##### Feature Engineering #####
-# Defining elite pitch status based on whiff percentage
-# The top 25% of pitches by whiff percentage will be considered "elite"
-whiff_threshold = df_merged[PERFORMANCE_METRIC].quantile(0.75)
-
-df_merged['is_elite'] = np.where(df_merged[PERFORMANCE_METRIC] >= whiff_threshold, 1, 0)
-
-print(f"Total number of elite pitches in the dataset: {df_merged['is_elite'].sum()}")
-
-
 ##### Define Features #####
 X_features=[
     'pitch_per',
     'pitcher_break_z_induced',
     'pitcher_break_x',
     'avg_speed',
-    'est_ba',	
-    'est_slg',	
+    'est_ba',
+    'est_slg',
     'est_woba',
     'hard_hit_percent',
     'pitch_hand',
@@ -93,190 +55,388 @@ CONTINUOUS_FEATURES = [
     'pitcher_break_z_induced',
     'pitcher_break_x',
     'avg_speed',
-    'est_ba',	
-    'est_slg',	
+    'est_ba',
+    'est_slg',
     'est_woba',
     'hard_hit_percent',
 ]
 
 RANDOM_STATE = 46
 
+# files written by the export stage into each registry version
+EXPORT_FILES = [
+    'confusion_matrix.json',
+    'feature_importance.json',
+    'roc_curve_fig.json',
+    'pitch_elite_test_results.csv',
+    'elite_pitch_random_forest.joblib',
+    'elite_pitch_forest.npz',
+    'preprocessing.joblib',
+    ATTRIBUTIONS_FILE,
+    RANKINGS_FILE,
+]
 
-X = df_merged[X_features].copy()
-X.dropna(inplace=True)
-
-Y = df_merged['is_elite']
-Y = Y[X.index] # Keep Y aligned with X
-
-# One hot encode categorical variables
-X = pd.get_dummies(X, columns=CATEGORICAL_FEATURES, drop_first=True)
 
-scaler = StandardScaler()
-X[CONTINUOUS_FEATURES] = scaler.fit_transform(X[CONTINUOUS_FEATURES])
+##### Stage Cache #####
+# Every stage's output is saved under a hash of the stage name, its parameters
+# and the hashes of the stages it reads from. Rerunning with the same inputs
+# loads the saved output, so changing a model parameter only refits and
+# re-evaluates; the data and features are reused.
+CACHE_DIR = '.cache/pipeline'
 
 
+def _hashable(part):
+    # A frame's pickle, and so its joblib hash, depends on pandas internals
+    # such as the copy-on-write setting. Frames are hashed on their columns,
+    # dtypes and values instead.
+    if isinstance(part, pd.DataFrame):
+        return (list(part.columns), [str(dtype) for dtype in part.dtypes], pd.util.hash_pandas_object(part).to_numpy())
+    return part
 
-##### Train/Test Split #####
-X_train, X_test, Y_train, Y_test = train_test_split(
-    X, 
-    Y, 
-    test_size=0.2, 
-    random_state=RANDOM_STATE, 
-    stratify=Y
-)
 
+def stage_hash(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(joblib.hash(_hashable(part)).encode())
+    return h.hexdigest()[:16]
 
 
-##### Model Training ######
-random_forest_model = RandomForestClassifier(
-    n_estimators=100,
-    random_state=RANDOM_STATE,
-    class_weight='balanced'
-)
+def stage_path(name, key):
+    return os.path.join(CACHE_DIR, f'{name}-{key}.joblib')
 
-random_forest_model.fit(X_train, Y_train)
 
-# Predict on test set
-Y_pred = random_forest_model.predict(X_test)
-Y_proba = random_forest_model.predict_proba(X_test)[:,1]
+def run_stage(name, key, compute, force=False):
+    path = stage_path(name, key)
+    if os.path.exists(path) and not force:
+        print(f'[{name}] cached ({key})')
+        return joblib.load(path)
 
+    start = time.perf_counter()
+    result = compute()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # written aside and moved into place, so an interrupted run never leaves
+    # a truncated file that would load as a cache hit
+    joblib.dump(result, path + '.tmp')
+    os.replace(path + '.tmp', path)
+    print(f'[{name}] {time.perf_counter() - start:.2f}s ({key})')
+    return result
 
 
+##### Data Cleaning, Merging #####
+def load_data(seasons=SEASONS):
+    # cleaned movement left joined with arsenal stats, shared with the site pages
+    return load_pitch_data(seasons)
 
-##### Model Evaluation #####
-print('Model Evaluation')
-print(classification_report(Y_test, Y_pred, target_names=['Non-Elite', 'Elite']))
-print(f"ROC AUC Score: {roc_auc_score(Y_test, Y_proba): .4f}")
-
-confusion_matrix = confusion_matrix(Y_test, Y_pred)
-cm_df = pd.DataFrame(
-    confusion_matrix, 
-    index=['Actual Non-Elite', 'Actual Elite'], 
-    columns=['Predicted Non-Elite', 'Predicted Elite']
-)
-
-# Heatmap
-fig_cm = go.Figure(data=go.Heatmap(
-    z=confusion_matrix,
-    x=['Predicted Non-Elite', 'Predicted Elite'],
-    y=['Actual Non-Elite', 'Actual Elite'],
-    colorscale='Blues',
-    colorbar=dict(title='Count')
-))
-
-# Add annotations
-for i in range(len(confusion_matrix)):
-    for j in range(len(confusion_matrix[0])):
-        fig_cm.add_annotation(
-            x=cm_df.columns[j], 
-            y=cm_df.index[i], 
-            text=str(confusion_matrix[i, j]),
-            showarrow=False,
-            font=dict(color="black" if confusion_matrix[i, j] < confusion_matrix.max() / 2 else "white", size=16)
-        )
-
-fig_cm.update_layout(
-    title='Confusion Matrix: Pitch Elite Status Prediction',
-    xaxis_title='Predicted Label',
-    yaxis_title='True Label',
-    yaxis=dict(autorange='reversed') # Makes the labels appear top-to-bottom
-)
-
-fig_cm.write_html('media/model_results/plotly_confusion_matrix.html')
-with open ('media/model_results/confusion_matrix.json', 'w') as f:
-    json.dump(fig_cm.to_json(), f)
-
-print("Plotly Confusion Matrix saved")
 
+##### Feature Engineering #####
+def build_features(df_merged):
+    # Defining elite pitch status based on whiff percentage
+    # The top 25% of pitches by whiff percentage will be considered "elite"
+    whiff_threshold = df_merged[PERFORMANCE_METRIC].quantile(0.75)
 
-print("-" * 50)
+    df_merged['is_elite'] = np.where(df_merged[PERFORMANCE_METRIC] >= whiff_threshold, 1, 0)
 
+    print(f"Total number of elite pitches in the dataset: {df_merged['is_elite'].sum()}")
 
-##### Feature Importance #####
-feature_importances = pd.Series(
-    random_forest_model.feature_importances_,
-    index=X.columns
-).sort_values(ascending=False)
+    X = df_merged[X_features].copy()
+    X.dropna(inplace=True)
 
+    Y = df_merged['is_elite']
+    Y = Y[X.index] # Keep Y aligned with X
 
-df_fi = pd.DataFrame({
-    'Feature': feature_importances.index,
-    'Importance': feature_importances.values
-})
+    # One hot encode categorical variables
+    X = pd.get_dummies(X, columns=CATEGORICAL_FEATURES, drop_first=True)
 
-fig_fi = px.bar(
-    df_fi,
-    x='Importance',
-    y='Feature',
-    orientation='h',
-    title='Feature Importance for Predicting Elite Pitches',
-    color='Importance',
-    color_continuous_scale=px.colors.sequential.Viridis
-)
+    scaler = StandardScaler()
+    X[CONTINUOUS_FEATURES] = scaler.fit_transform(X[CONTINUOUS_FEATURES])
+    return X, Y, scaler
 
-fig_fi.update_layout(
-    yaxis={'categoryorder':'total ascending'} 
-)
 
-fig_fi.write_html('media/model_results/plotly_feature_importance.html')
-with open ('media/model_results/feature_importance.json', 'w') as f:
-    json.dump(fig_fi.to_json(), f)
+##### Train/Test Split #####
+def split(X, Y, test_size=0.2, random_state=RANDOM_STATE):
+    return train_test_split(
+        X,
+        Y,
+        test_size=test_size,
+        random_state=random_state,
+        stratify=Y
+    )
 
-print("Plotly Feature Importance Plot saved")
 
+##### Model Training ######
+def fit(X_train, Y_train, params):
+    random_forest_model = RandomForestClassifier(
+        random_state=RANDOM_STATE,
+        class_weight='balanced',
+        **params
+    )
+    random_forest_model.fit(X_train, Y_train)
+    return random_forest_model
 
 
+##### Model Evaluation #####
+def evaluate(model, X_test, Y_test):
+    # Predict on test set
+    Y_pred = model.predict(X_test)
+    Y_proba = model.predict_proba(X_test)[:,1]
+    fpr, tpr, thresholds = roc_curve(Y_test, Y_proba)
+    return {
+        'Y_pred': Y_pred,
+        'Y_proba': Y_proba,
+        'report': classification_report(Y_test, Y_pred, target_names=['Non-Elite', 'Elite']),
+        'roc_auc': roc_auc_score(Y_test, Y_proba),
+        'confusion_matrix': confusion_matrix(Y_test, Y_pred),
+        'fpr': fpr,
+        'tpr': tpr,
+    }
+
+
+##### Export #####
+def confusion_matrix_figure(cm):
+    cm_df = pd.DataFrame(
+        cm,
+        index=['Actual Non-Elite', 'Actual Elite'],
+        columns=['Predicted Non-Elite', 'Predicted Elite']
+    )
 
-##### ROC Curve #####
-fpr, tpr, thresholds = roc_curve(Y_test, Y_proba)
-roc_auc = auc(fpr, tpr)
+    # Heatmap
+    fig_cm = go.Figure(data=go.Heatmap(
+        z=cm,
+        x=['Predicted Non-Elite', 'Predicted Elite'],
+        y=['Actual Non-Elite', 'Actual Elite'],
+        colorscale='Blues',
+        colorbar=dict(title='Count')
+    ))
+
+    # Add annotations
+    for i in range(len(cm)):
+        for j in range(len(cm[0])):
+            fig_cm.add_annotation(
+                x=cm_df.columns[j],
+                y=cm_df.index[i],
+                text=str(cm[i, j]),
+                showarrow=False,
+                font=dict(color="black" if cm[i, j] < cm.max() / 2 else "white", size=16)
+            )
+
+    fig_cm.update_layout(
+        title='Confusion Matrix: Pitch Elite Status Prediction',
+        xaxis_title='Predicted Label',
+        yaxis_title='True Label',
+        yaxis=dict(autorange='reversed') # Makes the labels appear top-to-bottom
+    )
+    return fig_cm
+
+
+def feature_importance_figure(model, columns):
+    feature_importances = pd.Series(
+        model.feature_importances_,
+        index=columns
+    ).sort_values(ascending=False)
+
+    df_fi = pd.DataFrame({
+        'Feature': feature_importances.index,
+        'Importance': feature_importances.values
+    })
+
+    fig_fi = px.bar(
+        df_fi,
+        x='Importance',
+        y='Feature',
+        orientation='h',
+        title='Feature Importance for Predicting Elite Pitches',
+        color='Importance',
+        color_continuous_scale=px.colors.sequential.Viridis
+    )
 
-fig_roc = go.Figure(
-    data=[
-        # ROC curve
-        go.Scatter(
-            x=fpr, 
-            y=tpr, 
-            mode='lines', 
-            name=f'ROC curve (area = {roc_auc:.4f})',
-            line=dict(color='darkorange', width=2)
-        ),
-        # Random guess line
-        go.Scatter(
-            x=[0, 1], 
-            y=[0, 1], 
-            mode='lines', 
-            name='Random Guess (AUC = 0.50)',
-            line=dict(dash='dash', color='navy')
+    fig_fi.update_layout(
+        yaxis={'categoryorder':'total ascending'}
+    )
+    return fig_fi
+
+
+def roc_figure(fpr, tpr):
+    roc_auc = auc(fpr, tpr)
+
+    return go.Figure(
+        data=[
+            # ROC curve
+            go.Scatter(
+                x=fpr,
+                y=tpr,
+                mode='lines',
+                name=f'ROC curve (area = {roc_auc:.4f})',
+                line=dict(color='darkorange', width=2)
+            ),
+            # Random guess line
+            go.Scatter(
+                x=[0, 1],
+                y=[0, 1],
+                mode='lines',
+                name='Random Guess (AUC = 0.50)',
+                line=dict(dash='dash', color='navy')
+            )
+        ],
+        layout=go.Layout(
+            title=f'Receiver Operating Characteristic (ROC) Curve (AUC: {roc_auc:.4f})',
+            xaxis=dict(title='False Positive Rate (FPR)', range=[0, 1]),
+            yaxis=dict(title='True Positive Rate (TPR)', range=[0, 1]),
+            showlegend=True,
+            legend=dict(x=0.6, y=0.1)
         )
-    ],
-    layout=go.Layout(
-        title=f'Receiver Operating Characteristic (ROC) Curve (AUC: {roc_auc:.4f})',
-        xaxis=dict(title='False Positive Rate (FPR)', range=[0, 1]),
-        yaxis=dict(title='True Positive Rate (TPR)', range=[0, 1]),
-        showlegend=True,
-        legend=dict(x=0.6, y=0.1)
     )
-)
-
-# Save the figure as a JSON string for Streamlit embedding
-with open('media/model_results/roc_curve_fig.json', 'w') as f:
-    # Plotly figures must be converted to JSON before saving
-    json.dump(fig_roc.to_json(), f)
 
-print("ROC Curve Plot saved")
 
-
-# Output which pitches were classified as elite
-df_test_results = X_test.copy()
-df_test_results['actual_is_elite'] = Y_test
-df_test_results['predicted_is_elite'] = Y_pred
-df_test_results['predicted_proba_elite'] = Y_proba
-df_test_results.reset_index(drop=True, inplace=True)
-df_test_results.to_csv('media/model_results/pitch_elite_test_results.csv', index=False)
-
-
-
-##### Save Model #####
-joblib.dump(random_forest_model, 'media/model_results/elite_pitch_random_forest.joblib')
-print('Model saved')
\ No newline at end of file
+def preprocessing_spec(scaler, X):
+    # Everything needed to turn raw pitch rows into the model's feature matrix,
+    # stored as plain arrays and lists (see utils/inference.py)
+    return {
+        'feature_columns': list(X.columns),
+        'continuous_features': list(CONTINUOUS_FEATURES),
+        'mean': scaler.mean_,
+        'scale': scaler.scale_,
+        'dummy_columns': {
+            feature: [column[len(feature) + 1:] for column in X.columns if column.startswith(f'{feature}_')]
+            for feature in CATEGORICAL_FEATURES
+        },
+    }
+
+
+def model_metrics(results):
+    tn, fp, fn, tp = results['confusion_matrix'].ravel()
+    return {
+        'roc_auc': float(results['roc_auc']),
+        'accuracy': float((tp + tn) / (tp + tn + fp + fn)),
+        'precision': float(tp / (tp + fp)) if tp + fp else 0.0,
+        'recall': float(tp / (tp + fn)) if tp + fn else 0.0,
+    }
+
+
+def export(model, X, X_test, Y_test, results, scaler, results_dir):
+    os.makedirs(results_dir, exist_ok=True)
+
+    fig_cm = confusion_matrix_figure(results['confusion_matrix'])
+    fig_cm.write_html(f'{results_dir}/plotly_confusion_matrix.html')
+    save_figure_json(fig_cm, f'{results_dir}/confusion_matrix.json')
+    print("Plotly Confusion Matrix saved")
+
+    fig_fi = feature_importance_figure(model, X.columns)
+    fig_fi.write_html(f'{results_dir}/plotly_feature_importance.html')
+    save_figure_json(fig_fi, f'{results_dir}/feature_importance.json')
+    print("Plotly Feature Importance Plot saved")
+
+    # Save the figure JSON for Streamlit embedding
+    save_figure_json(roc_figure(results['fpr'], results['tpr']), f'{results_dir}/roc_curve_fig.json')
+    print("ROC Curve Plot saved")
+
+    # Output which pitches were classified as elite
+    df_test_results = X_test.copy()
+    df_test_results['actual_is_elite'] = Y_test
+    df_test_results['predicted_is_elite'] = results['Y_pred']
+    df_test_results['predicted_proba_elite'] = results['Y_proba']
+    df_test_results.reset_index(drop=True, inplace=True)
+    df_test_results.to_csv(f'{results_dir}/pitch_elite_test_results.csv', index=False)
+
+    ##### Save Model #####
+    # the full sklearn forest, compressed, for analysis and retraining
+    joblib.dump(model, f'{results_dir}/elite_pitch_random_forest.joblib', compress=3)
+    # flat float32 node arrays the site scores with, memory-mapped on load
+    compact_forest(model).save(f'{results_dir}/elite_pitch_forest.npz')
+    joblib.dump(preprocessing_spec(scaler, X), f'{results_dir}/preprocessing.joblib')
+    print('Model saved')
+
+
+##### Pipeline #####
+def prepare(test_size=0.2, force=False):
+    # data, features and split stages, shared with utils/model_search.py
+    df_merged = load_data()
+    # only the columns the features and labels are built from, so derived
+    # columns added to the store do not invalidate the model
+    data_key = stage_hash('data', df_merged[X_features + [PERFORMANCE_METRIC]])
+
+    features_key = stage_hash('features', data_key, X_features, PERFORMANCE_METRIC)
+    X, Y, scaler = run_stage('features', features_key, lambda: build_features(df_merged), force)
+
+    split_key = stage_hash('split', features_key, test_size, RANDOM_STATE)
+    splits = run_stage('split', split_key, lambda: split(X, Y, test_size), force)
+    return X, Y, scaler, splits, {'data': data_key, 'split': split_key}
+
+
+def run_pipeline(model_params, test_size=0.2, force=False, activate=True):
+    X, Y, scaler, splits, keys = prepare(test_size, force)
+    X_train, X_test, Y_train, Y_test = splits
+    split_key = keys['split']
+
+    # n_jobs only changes how many cores are used, never the fitted forest
+    fit_params = {key: value for key, value in model_params.items() if key != 'n_jobs'}
+    fit_key = stage_hash('fit', split_key, fit_params, RANDOM_STATE)
+    model = run_stage('fit', fit_key, lambda: fit(X_train, Y_train, model_params), force)
+    model.n_jobs = model_params.get('n_jobs')
+
+    evaluate_key = stage_hash('evaluate', fit_key)
+    results = run_stage('evaluate', evaluate_key, lambda: evaluate(model, X_test, Y_test), force)
+
+    print('Model Evaluation')
+    print(results['report'])
+    print(f"ROC AUC Score: {results['roc_auc']: .4f}")
+    print("-" * 50)
+
+    # an export is a registry version, reused when these exact stages were
+    # exported before
+    export_key = stage_hash('export', evaluate_key)
+    version = None if force else registry.find_version(export_key)
+    if version:
+        print(f'[export] unchanged ({version})')
+    else:
+        version = registry.new_version(export_key)
+        export(model, X, X_test, Y_test, results, scaler, registry.version_dir(version))
+        # per-pitch explanations and the ranking of every pitch for the site,
+        # from the saved model files
+        write_attributions(build_attributions(version, SEASONS), version)
+        rankings, usage_threshold = build_rankings(version, SEASONS)
+        write_rankings(rankings, usage_threshold, version)
+        registry.write_metadata(version, {
+            'export_key': export_key,
+            'trained_at': datetime.fromtimestamp(os.path.getmtime(stage_path('fit', fit_key)), timezone.utc).isoformat(timespec='seconds'),
+            'exported_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'seasons': SEASONS,
+            'data_hash': keys['data'],
+            'performance_metric': PERFORMANCE_METRIC,
+            'features': X_features,
+            'feature_columns': list(X.columns),
+            'params': fit_params,
+            'test_size': test_size,
+            'train_rows': len(X_train),
+            'test_rows': len(X_test),
+            'metrics': model_metrics(results),
+            'files': EXPORT_FILES,
+        })
+        print(f'[export] registered {version}')
+    if activate:
+        registry.activate(version)
+        print(f'Active model: {version}')
+    return model, results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train and export the elite pitch classifier')
+    parser.add_argument('--n-estimators', type=int, default=100)
+    parser.add_argument('--max-depth', type=int, default=None)
+    parser.add_argument('--min-samples-leaf', type=int, default=1)
+    parser.add_argument('--test-size', type=float, default=0.2)
+    parser.add_argument('--n-jobs', type=int, default=-1, help='Cores for fitting and scoring, -1 uses all')
+    parser.add_argument('--force', action='store_true', help='Recompute every stage')
+    parser.add_argument('--no-activate', action='store_true', help='Register the model without pointing the site at it')
+    args = parser.parse_args()
+
+    run_pipeline(
+        model_params={
+            'n_estimators': args.n_estimators,
+            'max_depth': args.max_depth,
+            'min_samples_leaf': args.min_samples_leaf,
+            'n_jobs': args.n_jobs,
+        },
+        test_size=args.test_size,
+        force=args.force,
+        activate=not args.no_activate,
+    )
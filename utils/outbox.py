@@ -0,0 +1,439 @@
+# Durable outbox for contact form messages
+# Submissions are written to SQLite and the form returns straight away. A
+# background thread per process delivers them to the webhook, retrying with
+# backoff until it accepts them. Try it end to end from the repo root:
+#   python -m utils.outbox stub --port 8765 --fail-rate 0.3
+#   python -m utils.outbox send --url http://127.0.0.1:8765/hook --count 20
+# or run the automated delivery check against a stub of its own:
+#   python -m utils.outbox check
+##### Imports #####
+import argparse
+import os
+import json
+import logging
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import requests
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from requests.adapters import HTTPAdapter
+
+OUTBOX_PATH = 'data/contact_outbox.sqlite3'
+
+# messages sent per pass over the outbox, over one pooled connection
+BATCH_SIZE = 20
+
+# (connect, read) seconds for each webhook request
+TIMEOUT = (3.05, 10)
+
+# retry delays double from BASE_DELAY up to MAX_DELAY seconds, with jitter,
+# and a message is given up on after MAX_ATTEMPTS
+BASE_DELAY = 2
+MAX_DELAY = 15 * 60
+MAX_ATTEMPTS = 12
+
+# delivered messages are kept this many days, then dropped
+RETENTION_DAYS = 30
+
+_logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL,
+    delivered_at REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_due ON messages (next_attempt_at)
+    WHERE delivered_at IS NULL AND next_attempt_at IS NOT NULL;
+"""
+
+
+##### Outbox #####
+# One row per message. Pending rows have a next_attempt_at, delivered rows a
+# delivered_at, and rows that ran out of attempts have neither.
+class Outbox:
+    def __init__(self, path=OUTBOX_PATH):
+        self.path = path
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # A short lived connection per call, so the form and the worker
+        # thread never share one. Commits on success, rolls back on error.
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.row_factory = sqlite3.Row
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def enqueue(self, payload):
+        # Committed before returning, a message survives a crash or restart
+        now = time.time()
+        with self._connect() as connection:
+            cursor = connection.execute(
+                'INSERT INTO messages (payload, created_at, next_attempt_at) VALUES (?, ?, ?)',
+                (json.dumps(payload), now, now)
+            )
+        return cursor.lastrowid
+
+    def claim(self, limit, lease):
+        # Due messages, oldest first, held for lease seconds so another
+        # process sharing the outbox does not send them too
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            rows = connection.execute(
+                'SELECT id, payload, attempts FROM messages '
+                'WHERE delivered_at IS NULL AND next_attempt_at <= ? '
+                'ORDER BY next_attempt_at LIMIT ?',
+                (now, limit)
+            ).fetchall()
+            connection.executemany(
+                'UPDATE messages SET next_attempt_at = ? WHERE id = ?',
+                [(now + lease, row['id']) for row in rows]
+            )
+        return [(row['id'], json.loads(row['payload']), row['attempts']) for row in rows]
+
+    def delivered(self, ids):
+        with self._connect() as connection:
+            connection.executemany(
+                'UPDATE messages SET delivered_at = ?, next_attempt_at = NULL, '
+                'attempts = attempts + 1, last_error = NULL WHERE id = ?',
+                [(time.time(), message_id) for message_id in ids]
+            )
+
+    def failed(self, message_id, error, retry_at):
+        # retry_at of None gives the message up
+        with self._connect() as connection:
+            connection.execute(
+                'UPDATE messages SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?',
+                (retry_at, error, message_id)
+            )
+
+    def message(self, message_id):
+        # Delivery state of one message, None if it is not in the outbox
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT attempts, next_attempt_at, delivered_at, last_error FROM messages WHERE id = ?',
+                (message_id,)
+            ).fetchone()
+        return None if row is None else dict(row)
+
+    def next_due(self):
+        # Time the earliest pending message is due, None when nothing is pending
+        with self._connect() as connection:
+            return connection.execute(
+                'SELECT MIN(next_attempt_at) FROM messages WHERE delivered_at IS NULL'
+            ).fetchone()[0]
+
+    def counts(self):
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT '
+                'SUM(delivered_at IS NULL AND next_attempt_at IS NOT NULL), '
+                'SUM(delivered_at IS NOT NULL), '
+                'SUM(delivered_at IS NULL AND next_attempt_at IS NULL) '
+                'FROM messages'
+            ).fetchone()
+        return dict(zip(['pending', 'delivered', 'failed'], (value or 0 for value in row)))
+
+    def prune(self, days=RETENTION_DAYS):
+        with self._connect() as connection:
+            connection.execute(
+                'DELETE FROM messages WHERE delivered_at < ?', (time.time() - days * 86400,)
+            )
+
+
+##### Delivery #####
+def retry_delay(attempts, base=BASE_DELAY, cap=MAX_DELAY):
+    # Exponential backoff, jittered over the upper half of the window so
+    # messages that failed together do not retry together
+    delay = min(cap, base * 2 ** attempts)
+    return delay / 2 + random.random() * delay / 2
+
+
+def webhook_session(pool_size=4):
+    # Keep-alive connections reused across every message the worker sends.
+    # Retries are the outbox's job, so the adapter makes a single attempt.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class OutboxWorker(threading.Thread):
+    # Delivers outbox messages to the webhook until stopped. Sleeps until the
+    # next retry is due or wake() is called after a new message.
+    def __init__(self, outbox, url, batch_size=BATCH_SIZE, timeout=TIMEOUT,
+                 max_attempts=MAX_ATTEMPTS, base_delay=BASE_DELAY, idle_wait=60):
+        super().__init__(name='contact-outbox', daemon=True)
+        self.outbox = outbox
+        self.url = url
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.idle_wait = idle_wait
+        self.session = webhook_session()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wake.set()
+        self.join(timeout)
+
+    def send(self, payload):
+        # None when the webhook accepted the message, the error otherwise
+        try:
+            response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        except requests.RequestException as error:
+            return f'{type(error).__name__}: {error}'
+        if response.ok:
+            return None
+        return f'HTTP {response.status_code}'
+
+    def flush(self):
+        # One pass over the due messages, a batch at a time. Returns the number
+        # delivered. A failed message backs off on its own, the rest of the
+        # batch is still sent.
+        sent = 0
+        while not self._stopping.is_set():
+            # held long enough for every message in the batch to time out
+            batch = self.outbox.claim(self.batch_size, lease=self.batch_size * sum(self.timeout))
+            if not batch:
+                break
+            delivered = []
+            for message_id, payload, attempts in batch:
+                error = self.send(payload)
+                if error is None:
+                    delivered.append(message_id)
+                    continue
+                attempts += 1
+                retry_at = time.time() + retry_delay(attempts, self.base_delay) if attempts < self.max_attempts else None
+                if retry_at is None:
+                    _logger.error('Giving up on contact message %s after %s attempts: %s', message_id, attempts, error)
+                self.outbox.failed(message_id, error, retry_at)
+            self.outbox.delivered(delivered)
+            sent += len(delivered)
+            if len(batch) < self.batch_size:
+                break
+        return sent
+
+    def run(self):
+        self.outbox.prune()
+        while not self._stopping.is_set():
+            try:
+                self.flush()
+                next_due = self.outbox.next_due()
+            except Exception:
+                # the outbox keeps the messages, try again on the next pass
+                _logger.exception('Contact outbox flush failed')
+                next_due = None
+            wait = self.idle_wait if next_due is None else min(self.idle_wait, max(0, next_due - time.time()))
+            self._wake.wait(wait)
+            self._wake.clear()
+        self.session.close()
+
+
+##### Process Worker #####
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def outbox_worker(url, path=OUTBOX_PATH):
+    # The process-wide worker, started on first use and shared by every session
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive() or _worker.url != url:
+            if _worker is not None:
+                _worker.stop(timeout=0)
+            _worker = OutboxWorker(Outbox(path), url)
+            _worker.start()
+        return _worker
+
+
+def submit(payload, url, path=OUTBOX_PATH):
+    # Stores the message and returns its id, delivery happens in the background
+    worker = outbox_worker(url, path)
+    message_id = worker.outbox.enqueue(payload)
+    worker.wake()
+    return message_id
+
+
+##### Stub Webhook #####
+class StubWebhookHandler(BaseHTTPRequestHandler):
+    # Accepts JSON posts, failing or stalling a share of them at random.
+    # posts counts every request, received holds the accepted messages.
+    protocol_version = 'HTTP/1.1'
+    fail_rate = 0.0
+    delay = 0.0
+    quiet = False
+    posts = [0]
+    received = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.posts[0] += 1
+        time.sleep(self.delay)
+        if random.random() < self.fail_rate:
+            self.send_response(503)
+        else:
+            self.received.append(json.loads(body))
+            self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            print(f'stub {self.address_string()} {format % args}')
+
+
+def stub_server(port=0, fail_rate=0.0, delay=0.0, quiet=False):
+    # Local webhook for trying the worker, call serve_forever() to start it
+    handler = type('Handler', (StubWebhookHandler,), {
+        'fail_rate': fail_rate, 'delay': delay, 'quiet': quiet, 'posts': [0], 'received': []
+    })
+    return ThreadingHTTPServer(('127.0.0.1', port), handler)
+
+
+##### Delivery Check #####
+def _wait_for(condition, timeout):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def check_delivery(timeout=30):
+    # Runs a worker against stub webhooks and raises AssertionError unless it
+    #   - delivers every message exactly once through a flaky webhook
+    #   - backs a failed message off by a growing, jittered delay
+    #   - gives a message up after max_attempts
+    # Returns a line per scenario.
+    results = []
+    directory = tempfile.mkdtemp()
+
+    def run(name, fail_rate, **worker_options):
+        server = stub_server(fail_rate=fail_rate, quiet=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        worker = OutboxWorker(
+            Outbox(os.path.join(directory, f'{name}.sqlite3')),
+            f'http://127.0.0.1:{server.server_port}/hook',
+            **worker_options
+        )
+        return server, worker
+
+    # delivery: half the posts fail, every message still arrives once
+    server, worker = run('delivery', 0.5, base_delay=0.01)
+    ids = [worker.outbox.enqueue({'name': f'Test {i}', 'message': 'outbox check'}) for i in range(30)]
+    worker.start()
+    try:
+        assert _wait_for(lambda: worker.outbox.counts()['delivered'] == len(ids), timeout), \
+            f'only {worker.outbox.counts()} after {timeout}s'
+        received = sorted(message['name'] for message in server.RequestHandlerClass.received)
+        assert received == sorted(f'Test {i}' for i in range(30)), 'messages lost or sent twice'
+        retried = sum(worker.outbox.message(message_id)['attempts'] > 1 for message_id in ids)
+        assert retried > 0, 'no message needed a retry, the stub did not fail'
+    finally:
+        worker.stop(timeout=5)
+        server.shutdown()
+    results.append(f'delivery: 30 of 30 delivered once, {retried} after retries, {server.RequestHandlerClass.posts[0]} posts')
+
+    # backoff: the webhook always fails, each retry waits longer
+    server, worker = run('backoff', 1.0, base_delay=0.2)
+    message_id = worker.outbox.enqueue({'name': 'Test', 'message': 'outbox check'})
+    delays = []
+    try:
+        for attempts in (1, 2, 3):
+            start = time.time()
+            worker.flush()
+            state = worker.outbox.message(message_id)
+            assert state['attempts'] == attempts and state['delivered_at'] is None, state
+            delay = state['next_attempt_at'] - start
+            window = 0.2 * 2 ** attempts
+            assert window / 2 <= delay <= window + 0.5, f'retry {attempts} waits {delay:.2f}s, expected {window / 2}-{window}s'
+            delays.append(delay)
+            # make it due again without waiting out the delay
+            with worker.outbox._connect() as connection:
+                connection.execute('UPDATE messages SET next_attempt_at = 0 WHERE id = ?', (message_id,))
+    finally:
+        server.shutdown()
+    results.append('backoff: retries wait ' + ', '.join(f'{delay:.2f}s' for delay in delays))
+
+    # give up: no more attempts after max_attempts
+    server, worker = run('give_up', 1.0, base_delay=0.01, max_attempts=3)
+    message_id = worker.outbox.enqueue({'name': 'Test', 'message': 'outbox check'})
+    worker.start()
+    try:
+        assert _wait_for(lambda: worker.outbox.counts()['failed'] == 1, timeout), worker.outbox.message(message_id)
+        state = worker.outbox.message(message_id)
+        assert state['attempts'] == 3 and state['next_attempt_at'] is None, state
+        assert state['last_error'] == 'HTTP 503', state
+        time.sleep(0.2)
+        assert server.RequestHandlerClass.posts[0] == 3, f'{server.RequestHandlerClass.posts[0]} posts for 3 attempts'
+    finally:
+        worker.stop(timeout=5)
+        server.shutdown()
+    results.append('give up: stopped after 3 attempts, last error HTTP 503')
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Contact form outbox tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    stub_parser = subparsers.add_parser('stub', help='Run a local stub webhook')
+    stub_parser.add_argument('--port', type=int, default=8765)
+    stub_parser.add_argument('--fail-rate', type=float, default=0.0, help='Share of posts answered with 503')
+    stub_parser.add_argument('--delay', type=float, default=0.0, help='Seconds to stall every post')
+    send_parser = subparsers.add_parser('send', help='Queue test messages and deliver them')
+    send_parser.add_argument('--url', required=True)
+    send_parser.add_argument('--count', type=int, default=10)
+    send_parser.add_argument('--path', default=OUTBOX_PATH)
+    send_parser.add_argument('--wait', type=float, default=60, help='Seconds to wait for delivery')
+    subparsers.add_parser('check', help='Check delivery, backoff and give-up against stub webhooks, exits 1 on failure')
+    status_parser = subparsers.add_parser('status', help='Count pending, delivered and failed messages')
+    status_parser.add_argument('--path', default=OUTBOX_PATH)
+    args = parser.parse_args()
+
+    if args.command == 'stub':
+        server = stub_server(args.port, args.fail_rate, args.delay)
+        print(f'Stub webhook on http://127.0.0.1:{server.server_port}/hook')
+        server.serve_forever()
+    elif args.command == 'send':
+        start = time.perf_counter()
+        for i in range(args.count):
+            submit({'email': 'test@example.com', 'name': f'Test {i}', 'message': 'outbox test'}, args.url, args.path)
+        print(f'Queued {args.count} messages in {(time.perf_counter() - start) * 1000:.1f} ms')
+        outbox = Outbox(args.path)
+        deadline = time.time() + args.wait
+        while outbox.counts()['pending'] and time.time() < deadline:
+            time.sleep(0.2)
+        print(outbox.counts())
+    elif args.command == 'check':
+        try:
+            for line in check_delivery():
+                print(f'ok  {line}')
+        except AssertionError as error:
+            print(f'FAILED  {error}')
+            sys.exit(1)
+    else:
+        print(Outbox(args.path).counts())
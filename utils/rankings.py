@@ -0,0 +1,143 @@
+# Batch scoring of every pitch with a registered model, ranked for the site
+# Written next to each registry version by utils/models.py, or run from the
+# repo root for an existing version:
+#   python -m utils.rankings                 # active version
+#   python -m utils.rankings --version 20251018-152500-1a2b3c
+##### Imports #####
+import argparse
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+from utils.data import cached, load_pitch_data
+from utils.inference import MODEL_FILE, PREPROCESSING_FILE, load_scorer
+from utils.registry import active_version, artifact_path
+
+RANKINGS_FILE = 'pitch_rankings.feather'
+
+# MLB average xSLG, the dashed line on the usage vs xSLG chart
+LEAGUE_XSLG = 0.42
+
+CHUNK_SIZE = 5000
+
+RANKING_COLUMNS = [
+    'pitch_key',
+    'year',
+    'pitcher_name',
+    'pitcher_id',
+    'team_name_abbrev',
+    'pitch_hand',
+    'pitch_type',
+    'pitch_type_name',
+    'pitch_per',
+    'est_slg',
+    'est_woba',
+    'whiff_percent',
+    'pitcher_break_x',
+    'pitcher_break_z_induced',
+    'avg_speed',
+]
+
+
+##### Scoring #####
+def score_in_chunks(scorer, df, chunk_size=CHUNK_SIZE):
+    # Probability of elite for rows with every model feature, NaN otherwise
+    proba = np.full(len(df), np.nan, dtype='float32')
+    scorable = np.flatnonzero(df[scorer.input_features].notna().all(axis=1).to_numpy())
+    for start in range(0, len(scorable), chunk_size):
+        rows = scorable[start:start + chunk_size]
+        proba[rows] = scorer.score(df.iloc[rows])
+    return proba
+
+
+def quadrants(df, usage_threshold):
+    # Quadrants of the usage (y) vs xSLG (x) chart:
+    # 1 high usage / high xSLG, 2 high usage / low xSLG,
+    # 3 low usage / low xSLG, 4 low usage / high xSLG
+    high_usage = df['pitch_per'].to_numpy() >= usage_threshold
+    high_xslg = df['est_slg'].to_numpy() >= LEAGUE_XSLG
+    quadrant = np.select(
+        [high_usage & high_xslg, high_usage & ~high_xslg, ~high_usage & ~high_xslg],
+        [1, 2, 3],
+        default=4
+    ).astype('int8')
+    quadrant[df['est_slg'].isna().to_numpy()] = 0
+    return quadrant
+
+
+def build_rankings(version=None, seasons=None, chunk_size=CHUNK_SIZE):
+    # Every stored pitch scored with the given version, the active one by default
+    version = version or active_version()
+    scorer = load_scorer(artifact_path(MODEL_FILE, version), artifact_path(PREPROCESSING_FILE, version))
+    df = load_pitch_data(seasons)
+    usage_threshold = float(df['pitch_per'].median())
+
+    rankings = df[RANKING_COLUMNS].copy()
+    rankings['proba_elite'] = score_in_chunks(scorer, df, chunk_size)
+    rankings['quadrant'] = quadrants(df, usage_threshold)
+
+    # Undervalued: low usage, low xSLG pitches ordered by how elite the model
+    # thinks they are. Rank 1 is the best candidate, other rows get 0. The
+    # table is stored undervalued rows first, in rank order, then the rest.
+    undervalued = (rankings['quadrant'] == 3) & rankings['proba_elite'].notna()
+    order = rankings.sort_values(
+        ['proba_elite', 'pitch_key'], ascending=[False, True], na_position='last'
+    ).index
+    is_undervalued = undervalued.loc[order].to_numpy()
+    rankings['undervalued_rank'] = 0
+    rankings.loc[order[is_undervalued], 'undervalued_rank'] = np.arange(1, is_undervalued.sum() + 1)
+    rankings = rankings.loc[order[is_undervalued].append(order[~is_undervalued])]
+    rankings = rankings.reset_index(drop=True)
+    return rankings, usage_threshold
+
+
+def write_rankings(rankings, usage_threshold, version):
+    table = pa.Table.from_pandas(rankings, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **table.schema.metadata,
+        b'model_version': version.encode(),
+        b'usage_threshold': str(usage_threshold).encode(),
+        b'league_xslg': str(LEAGUE_XSLG).encode(),
+    })
+    feather.write_feather(table, artifact_path(RANKINGS_FILE, version), compression='uncompressed')
+
+
+##### Queries #####
+def load_rankings(version=None):
+    # Ranking table of a model version, the active one by default, indexed by
+    # (year, pitch_key) with undervalued pitches first in rank order. Activating
+    # another version changes the path, so the site never shows probabilities
+    # from a model it is not using.
+    path = artifact_path(RANKINGS_FILE, version)
+
+    def read():
+        return feather.read_table(path, memory_map=True).to_pandas().set_index(['year', 'pitch_key'])
+    return cached(('rankings', path), [path], read)
+
+
+def load_undervalued(version=None):
+    # Just the undervalued rows, already in rank order
+    path = artifact_path(RANKINGS_FILE, version)
+
+    def read():
+        rankings = load_rankings(version)
+        return rankings[rankings['undervalued_rank'] > 0]
+    return cached(('undervalued', path), [path], read)
+
+
+def top_undervalued(k=10, version=None):
+    return load_undervalued(version).iloc[:k]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score and rank every pitch with the saved model')
+    parser.add_argument('--version', default=None, help='Registry version, defaults to the active one')
+    parser.add_argument('--seasons', type=int, nargs='*', default=None, help='Seasons to score, defaults to all stored')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    version = args.version or active_version()
+    rankings, usage_threshold = build_rankings(version, args.seasons, args.chunk_size)
+    write_rankings(rankings, usage_threshold, version)
+    print(f'Scored {rankings["proba_elite"].notna().sum()} of {len(rankings)} pitches, usage threshold {usage_threshold:.3f}')
+    print(rankings[rankings['undervalued_rank'] > 0].head(10)[['pitcher_name', 'pitch_type_name', 'pitch_per', 'est_slg', 'proba_elite']].to_string(index=False))
+    print(f'Rankings saved to {artifact_path(RANKINGS_FILE, version)}')
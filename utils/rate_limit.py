@@ -0,0 +1,202 @@
+# Throttling and duplicate suppression for contact form submissions
+# Flood the submit path from the repo root and watch its latency:
+#   python -m utils.rate_limit load-test --threads 32 --requests 5000
+##### Imports #####
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+
+# (burst, seconds per token). A visitor can send a few messages back to back,
+# then one a minute. Addresses get more room since offices and phones on one
+# carrier share them.
+SESSION_LIMIT = (3, 60)
+ADDRESS_LIMIT = (10, 30)
+
+# identical messages within this many seconds are only sent once
+DUPLICATE_WINDOW = 10 * 60
+
+# most keys tracked by a bucket or the duplicate window before the least
+# recently seen are dropped, bounding memory under a flood of new sessions
+MAX_KEYS = 10_000
+
+
+##### Token Bucket #####
+class TokenBucket:
+    # One bucket per key, refilled continuously at one token per period up to
+    # burst tokens. Buckets idle long enough to be full again are forgotten.
+    def __init__(self, burst, period, max_keys=MAX_KEYS):
+        self.burst = burst
+        self.period = period
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key, now=None):
+        # Takes a token for key, False when it has none left
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) / self.period)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed
+
+    def refund(self, key):
+        # Gives back a token taken by allow(), for work that never happened
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated = self._buckets[key]
+                self._buckets[key] = (min(self.burst, tokens + 1), updated)
+
+
+##### Duplicates #####
+def message_hash(payload):
+    # Same sender and text, ignoring case and surrounding whitespace
+    normalized = {key: str(value).strip().lower() for key, value in payload.items()}
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+
+class DuplicateWindow:
+    # Remembers message hashes for window seconds
+    def __init__(self, window=DUPLICATE_WINDOW, max_keys=MAX_KEYS):
+        self.window = window
+        self.max_keys = max_keys
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, payload, now=None):
+        # True the first time a message is seen in the window, recording it
+        now = time.monotonic() if now is None else now
+        key = message_hash(payload)
+        with self._lock:
+            # entries are in first-seen order, so expired ones are at the front
+            while self._seen and next(iter(self._seen.values())) <= now - self.window:
+                self._seen.popitem(last=False)
+            if key in self._seen:
+                return False
+            self._seen[key] = now
+            while len(self._seen) > self.max_keys:
+                self._seen.popitem(last=False)
+        return True
+
+    def release(self, payload):
+        # Forgets a claimed message, so it can be sent again
+        with self._lock:
+            self._seen.pop(message_hash(payload), None)
+
+
+##### Admission #####
+# Shared by every session in the process
+_session_bucket = TokenBucket(*SESSION_LIMIT)
+_address_bucket = TokenBucket(*ADDRESS_LIMIT)
+_recent_messages = DuplicateWindow()
+
+
+def admit(payload, session_id, address=None):
+    # Checked before a message is queued. Returns None when it may be sent,
+    # 'rate_limited' or 'duplicate' otherwise. Local visitors have no address
+    # and are limited per session only. A refused message costs no tokens,
+    # so resubmitting a duplicate never locks out a different message.
+    if not _session_bucket.allow(session_id):
+        return 'rate_limited'
+    if address is not None and not _address_bucket.allow(address):
+        _session_bucket.refund(session_id)
+        return 'rate_limited'
+    if not _recent_messages.claim(payload):
+        _session_bucket.refund(session_id)
+        if address is not None:
+            _address_bucket.refund(address)
+        return 'duplicate'
+    return None
+
+
+def release(payload, session_id, address=None):
+    # Undoes an admit() whose message could not be queued: the tokens are
+    # refunded and the message is no longer a duplicate, so a retry goes
+    # through
+    _recent_messages.release(payload)
+    _session_bucket.refund(session_id)
+    if address is not None:
+        _address_bucket.refund(address)
+
+
+##### Load Test #####
+def load_test(threads=32, requests_per_thread=200, addresses=8):
+    # Many threads hammer admit() and the outbox as fast as they can, from a
+    # handful of addresses and a new session per request (the worst case for
+    # the limiter), against a local stub webhook. Returns per-call latencies in
+    # submission order and the number of posts the webhook received.
+    from utils.outbox import Outbox, OutboxWorker, stub_server
+
+    server = stub_server(quiet=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/hook'
+    outbox_path = os.path.join(tempfile.mkdtemp(), 'outbox.sqlite3')
+    worker = OutboxWorker(Outbox(outbox_path), url)
+    worker.start()
+
+    latencies = np.zeros((threads, requests_per_thread))
+    started = np.zeros((threads, requests_per_thread))
+    outcomes = {}
+    outcomes_lock = threading.Lock()
+    start = time.perf_counter()
+
+    def flood(thread):
+        counts = {}
+        for i in range(requests_per_thread):
+            payload = {'email': 'bot@example.com', 'name': 'bot', 'message': f'spam {i % 50}'}
+            t = time.perf_counter()
+            outcome = admit(payload, f'session-{thread}-{i}', f'10.0.0.{(thread + i) % addresses}')
+            if outcome is None:
+                worker.outbox.enqueue(payload)
+                worker.wake()
+            latencies[thread, i] = time.perf_counter() - t
+            started[thread, i] = t - start
+            counts[outcome or 'queued'] = counts.get(outcome or 'queued', 0) + 1
+        with outcomes_lock:
+            for outcome, count in counts.items():
+                outcomes[outcome] = outcomes.get(outcome, 0) + count
+
+    pool = [threading.Thread(target=flood, args=(thread,)) for thread in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    deadline = time.time() + 10
+    while worker.outbox.counts()['pending'] and time.time() < deadline:
+        time.sleep(0.05)
+    worker.stop(timeout=5)
+    server.shutdown()
+
+    order = np.argsort(started.ravel())
+    return latencies.ravel()[order], outcomes, len(server.RequestHandlerClass.received), elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Contact form rate limiting tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    load_parser = subparsers.add_parser('load-test', help='Flood the submit path and report latency')
+    load_parser.add_argument('--threads', type=int, default=32)
+    load_parser.add_argument('--requests', type=int, default=5000, help='Total submissions')
+    load_parser.add_argument('--addresses', type=int, default=8, help='Distinct client addresses')
+    args = parser.parse_args()
+
+    latencies, outcomes, posts, elapsed = load_test(args.threads, args.requests // args.threads, args.addresses)
+    print(f'{len(latencies)} submissions in {elapsed:.2f} s ({len(latencies) / elapsed:.0f}/s): {outcomes}')
+    print(f'Webhook received {posts} posts')
+    # latency through the flood, each tenth of the submissions in turn
+    print('slice    p50 ms   p99 ms   max ms')
+    for i, chunk in enumerate(np.array_split(latencies * 1000, 10)):
+        print(f'{i + 1:>5}  {np.percentile(chunk, 50):>7.3f}  {np.percentile(chunk, 99):>7.3f}  {chunk.max():>7.3f}')
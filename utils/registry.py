@@ -0,0 +1,117 @@
+# Local registry of exported elite pitch models
+# Every export from utils/models.py gets its own version directory, and the
+# site reads the one named in the ACTIVE pointer. Run from the repo root:
+#   python -m utils.registry list
+#   python -m utils.registry activate 20251018-152500-1a2b3c
+##### Imports #####
+import argparse
+import json
+import os
+import time
+from utils.data import cached
+
+REGISTRY_DIR = 'media/model_registry'
+ACTIVE_PATH = os.path.join(REGISTRY_DIR, 'ACTIVE')
+METADATA_FILE = 'metadata.json'
+
+
+##### Versions #####
+def version_dir(version):
+    return os.path.join(REGISTRY_DIR, version)
+
+
+def new_version(export_key):
+    # Timestamped so versions sort by age, suffixed with the export stage
+    # hash so the same model exported twice is easy to spot
+    version = f"{time.strftime('%Y%m%d-%H%M%S')}-{export_key[:6]}"
+    os.makedirs(version_dir(version))
+    return version
+
+
+def write_metadata(version, metadata):
+    # Written last, a version without metadata is an unfinished export
+    path = os.path.join(version_dir(version), METADATA_FILE)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump({'version': version, **metadata}, f, indent=2, default=str)
+    os.replace(f'{path}.tmp', path)
+
+
+def read_metadata(version):
+    path = os.path.join(version_dir(version), METADATA_FILE)
+
+    def read():
+        with open(path, 'r') as f:
+            return json.load(f)
+    return cached(('model_metadata', path), [path], read)
+
+
+def list_versions():
+    # Finished versions, oldest first
+    if not os.path.isdir(REGISTRY_DIR):
+        return []
+    return sorted(
+        name for name in os.listdir(REGISTRY_DIR)
+        if os.path.exists(os.path.join(version_dir(name), METADATA_FILE))
+    )
+
+
+def find_version(export_key):
+    # Latest finished version exported from these exact pipeline stages
+    for version in reversed(list_versions()):
+        if read_metadata(version).get('export_key') == export_key:
+            return version
+    return None
+
+
+##### Active Pointer #####
+def activate(version):
+    if version not in list_versions():
+        raise ValueError(f'Unknown or unfinished model version: {version}')
+    missing = [
+        name for name in read_metadata(version)['files']
+        if not os.path.exists(os.path.join(version_dir(version), name))
+    ]
+    if missing:
+        raise ValueError(f'Model version {version} is missing {missing}')
+    # replaced in one step, so a running app never reads a half-written pointer
+    with open(f'{ACTIVE_PATH}.tmp', 'w') as f:
+        f.write(version)
+    os.replace(f'{ACTIVE_PATH}.tmp', ACTIVE_PATH)
+
+
+def active_version():
+    # Re-read only when the pointer file changes. Everything loaded from the
+    # active version is cached under its versioned path, so the app picks up
+    # a newly activated model on its next rerun without a restart.
+    def read():
+        with open(ACTIVE_PATH, 'r') as f:
+            return f.read().strip()
+    return cached(('active_model', ACTIVE_PATH), [ACTIVE_PATH], read)
+
+
+def active_metadata():
+    return read_metadata(active_version())
+
+
+def artifact_path(name, version=None):
+    # Path of an exported file in the given version, the active one by default
+    return os.path.join(version_dir(version or active_version()), name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='List and activate exported elite pitch models')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help='Show every finished version')
+    activate_parser = subparsers.add_parser('activate', help='Point the site at a version')
+    activate_parser.add_argument('version')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        active = active_version() if os.path.exists(ACTIVE_PATH) else None
+        for version in list_versions():
+            metadata = read_metadata(version)
+            marker = '*' if version == active else ' '
+            print(f"{marker} {version}  AUC {metadata['metrics']['roc_auc']:.4f}  {metadata['params']}")
+    else:
+        activate(args.version)
+        print(f'Active model: {args.version}')
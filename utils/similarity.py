@@ -0,0 +1,90 @@
+# Nearest neighbor index over pitch movement profiles
+##### Imports #####
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+from utils.data import cached, load_pitch_data, season_paths
+
+MOVEMENT_FEATURES = ['pitcher_break_x', 'pitcher_break_z_induced', 'avg_speed']
+
+# neighbors averaged for the outlier score
+OUTLIER_NEIGHBORS = 10
+
+
+##### Index #####
+# Movement is standardized so an inch of break and a mph of speed count the
+# same as one standard deviation each. KD-trees answer every query with a
+# log-time search instead of a scan over all pitches:
+#   - one over every pitch and one per pitch type, standardized league wide,
+#     for "most similar"
+#   - one per pitch type, standardized within the type, for outlier scores
+# The outlier score is the mean distance to a pitch's nearest same-type
+# neighbors, in within-type standard deviations: a curveball far from every
+# other curveball scores high even if it moves like some slider.
+class PitchSimilarityIndex:
+    def __init__(self, df, features=MOVEMENT_FEATURES, outlier_neighbors=OUTLIER_NEIGHBORS):
+        self.frame = df
+        self.features = features
+        X = df[features].to_numpy(dtype='float64')
+
+        self.mean = X.mean(axis=0)
+        self.scale = X.std(axis=0)
+        self.standardized = (X - self.mean) / self.scale
+        self.tree = KDTree(self.standardized)
+        self.positions = pd.MultiIndex.from_arrays([df['year'], df['pitch_key']])
+
+        self.type_rows = {
+            pitch_type: np.asarray(rows)
+            for pitch_type, rows in df.groupby('pitch_type_name', observed=True).indices.items()
+        }
+        self.type_trees = {
+            pitch_type: KDTree(self.standardized[rows])
+            for pitch_type, rows in self.type_rows.items()
+        }
+        self.outlier_score = np.full(len(df), np.nan)
+        for rows in self.type_rows.values():
+            if len(rows) < 2:
+                continue
+            Z = X[rows]
+            Z = (Z - Z.mean(axis=0)) / np.where(Z.std(axis=0) > 0, Z.std(axis=0), 1)
+            k = min(outlier_neighbors, len(rows) - 1)
+            # the nearest hit of every row is the row itself
+            distances, _ = KDTree(Z).query(Z, k=k + 1)
+            self.outlier_score[rows] = distances[:, 1:].mean(axis=1)
+        # share of the other pitches of the same type that are less unusual,
+        # NaN for the only pitch of its type, which has nothing to compare with
+        by_type = pd.Series(self.outlier_score).groupby(df['pitch_type_name'].to_numpy(), observed=True)
+        others = by_type.transform('count') - 1
+        self.outlier_percentile = ((by_type.rank() - 1) / others.where(others > 0)).to_numpy()
+
+    def row(self, year, pitch_key):
+        return self.positions.get_loc((year, pitch_key))
+
+    def similar(self, year, pitch_key, k=10, same_type=False):
+        # The k pitches whose movement is closest to this one, nearest first
+        row = self.row(year, pitch_key)
+        point = self.standardized[[row]]
+        if same_type:
+            pitch_type = self.frame['pitch_type_name'].iat[row]
+            rows = self.type_rows[pitch_type]
+            distances, neighbors = self.type_trees[pitch_type].query(point, k=min(k + 1, len(rows)))
+            distances, neighbors = distances[0], rows[neighbors[0]]
+        else:
+            distances, neighbors = self.tree.query(point, k=min(k + 1, len(self.frame)))
+            distances, neighbors = distances[0], neighbors[0]
+
+        keep = neighbors != row
+        result = self.frame.iloc[neighbors[keep][:k]].copy()
+        result['distance'] = distances[keep][:k]
+        result['outlier_percentile'] = self.outlier_percentile[neighbors[keep][:k]]
+        return result
+
+
+def load_similarity_index(seasons=None):
+    # Built once per dataset version and shared across sessions
+    seasons = tuple(sorted(seasons)) if seasons is not None else None
+    return cached(
+        ('similarity_index', seasons),
+        season_paths(seasons),
+        lambda: PitchSimilarityIndex(load_pitch_data(seasons))
+    )
@@ -0,0 +1,103 @@
+# Precomputed statistics for the pitch charts
+##### Imports #####
+import numpy as np
+import pandas as pd
+from scipy.special import stdtrit
+from utils.data import cached, load_pitch_data, season_paths
+
+
+##### OLS Trendlines #####
+# Least squares only needs a handful of sums per group, and sums add across
+# groups. Storing them per pitch type lets any selection of pitch types be
+# fit exactly by adding its rows together, no refit over the points.
+OLS_SUMS = ['n', 'sx', 'sy', 'sxx', 'sxy', 'syy', 'x_min', 'x_max']
+
+
+def ols_sums(df, x, y, by):
+    df = df[[by, x, y]].dropna()
+    xs = df[x].to_numpy(dtype='float64')
+    ys = df[y].to_numpy(dtype='float64')
+    parts = pd.DataFrame({
+        by: df[by].to_numpy(),
+        'n': 1.0,
+        'sx': xs,
+        'sy': ys,
+        'sxx': xs * xs,
+        'sxy': xs * ys,
+        'syy': ys * ys,
+        'x_min': xs,
+        'x_max': xs
+    })
+    grouped = parts.groupby(by, observed=True)
+    sums = grouped[['n', 'sx', 'sy', 'sxx', 'sxy', 'syy']].sum()
+    sums['x_min'] = grouped['x_min'].min()
+    sums['x_max'] = grouped['x_max'].max()
+    return sums
+
+
+def add_sums(frames):
+    # Sums of the same groups from separate row sets (seasons), added together
+    stacked = pd.concat(frames)
+    grouped = stacked.groupby(level=0, observed=True)
+    sums = grouped[['n', 'sx', 'sy', 'sxx', 'sxy', 'syy']].sum()
+    sums['x_min'] = grouped['x_min'].min()
+    sums['x_max'] = grouped['x_max'].max()
+    return sums
+
+
+def combine_sums(sums, groups=None):
+    if groups is not None:
+        sums = sums[sums.index.isin(groups)]
+    combined = sums[['n', 'sx', 'sy', 'sxx', 'sxy', 'syy']].sum()
+    combined['x_min'] = sums['x_min'].min()
+    combined['x_max'] = sums['x_max'].max()
+    return combined
+
+
+def ols_fit(sums):
+    # Closed form fit from the sums of one group (a Series) or many (a frame)
+    n = sums['n']
+    x_mean = sums['sx'] / n
+    y_mean = sums['sy'] / n
+    s_xx = sums['sxx'] - n * x_mean ** 2
+    s_xy = sums['sxy'] - n * x_mean * y_mean
+    s_yy = sums['syy'] - n * y_mean ** 2
+    slope = s_xy / s_xx
+    intercept = y_mean - slope * x_mean
+    residual_ss = np.maximum(s_yy - slope * s_xy, 0)
+    return pd.DataFrame({
+        'n': n,
+        'slope': slope,
+        'intercept': intercept,
+        'r2': 1 - residual_ss / s_yy,
+        'x_mean': x_mean,
+        's_xx': s_xx,
+        'residual_se': np.sqrt(residual_ss / (n - 2)),
+        'x_min': sums['x_min'],
+        'x_max': sums['x_max']
+    }, index=sums.index if isinstance(sums, pd.DataFrame) else [0])
+
+
+def ols_band(fit, points=50, level=0.95):
+    # Fitted line and confidence band for the mean over the fitted x range
+    fit = fit.iloc[0] if isinstance(fit, pd.DataFrame) else fit
+    xs = np.linspace(fit['x_min'], fit['x_max'], points)
+    ys = fit['intercept'] + fit['slope'] * xs
+    t = stdtrit(fit['n'] - 2, 0.5 + level / 2)
+    half_width = t * fit['residual_se'] * np.sqrt(1 / fit['n'] + (xs - fit['x_mean']) ** 2 / fit['s_xx'])
+    return xs, ys, ys - half_width, ys + half_width
+
+
+def load_ols_sums(x, y, by, seasons=None):
+    # Per group sums, computed once per season and added across seasons, so
+    # an ingest into one season only recomputes that season's sums
+    if seasons is None:
+        seasons = load_pitch_data()['year'].unique()
+    return add_sums([
+        cached(
+            ('ols_sums', x, y, by, int(year)),
+            season_paths([year]),
+            lambda year=year: ols_sums(load_pitch_data([year]), x, y, by)
+        )
+        for year in sorted(seasons)
+    ])
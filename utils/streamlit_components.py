@@ -1,13 +1,220 @@
+import argparse
 import streamlit as st
-import pandas as pd
 import plotly.express as px
-import statsmodels
+import plotly.graph_objects as go
+import numpy as np
+import json
+import logging
+import sys
+from utils.data import load_pitch_data
+from utils.downsample import density_with_outliers
+from utils.explain import load_attributions, pitch_attribution
+from utils.figure_cache import figure_json, normalize
+from utils.filter_index import load_filter_index
+from utils.inference import load_scorer
+from utils.registry import active_version
+from utils.similarity import load_similarity_index
+from utils.stats import combine_sums, load_ols_sums, ols_band, ols_fit
 
-def pitch_movement_chart():
+# Streamlit version the internals below were checked against with
+# python -m utils.streamlit_components check. Any other version uses
+# st.plotly_chart until the check passes on it and this is bumped.
+FAST_CHART_STREAMLIT_VERSION = '1.50.0'
+
+try:
+    # streamlit internals used to send a prebuilt figure spec, pinned in requirements.txt
+    if st.__version__ != FAST_CHART_STREAMLIT_VERSION:
+        raise ImportError(f'plotly_json_chart is unchecked on Streamlit {st.__version__}')
+    from streamlit.elements.lib.form_utils import current_form_id
+    from streamlit.elements.lib.utils import compute_and_register_element_id
+    from streamlit.proto.PlotlyChart_pb2 import PlotlyChart as PlotlyChartProto
+except ImportError:
+    PlotlyChartProto = None
+
+_logger = logging.getLogger(__name__)
+# set once the fast path has drawn a chart, after which its errors are real
+_fast_chart_works = False
+
+
+def _enqueue_plotly_spec(spec, key):
+    dg = st._main
+    proto = PlotlyChartProto()
+    proto.use_container_width = True
+    proto.theme = 'streamlit'
+    proto.form_id = current_form_id(dg)
+    proto.spec = spec
+    proto.config = json.dumps({})
+    proto.id = compute_and_register_element_id(
+        'plotly_chart',
+        user_key=key,
+        key_as_main_identity=False,
+        dg=dg,
+        plotly_spec=proto.spec,
+        plotly_config=proto.config,
+        selection_mode=[],
+        is_selection_activated=False,
+        theme='streamlit',
+        use_container_width=True,
+    )
+    return dg._enqueue('plotly_chart', proto)
+
+
+def plotly_json_chart(spec, key=None):
+    # Same as st.plotly_chart(fig, use_container_width=True) for a figure that
+    # is already serialized, skipping the to_dict/to_json round trip. Falls
+    # back to st.plotly_chart for good if the first chart it draws fails in
+    # any way.
+    global PlotlyChartProto, _fast_chart_works
+    if PlotlyChartProto is not None:
+        try:
+            element = _enqueue_plotly_spec(spec, key)
+        except Exception:
+            if _fast_chart_works:
+                raise
+            _logger.warning('Streamlit internals changed, plotly_json_chart falls back to st.plotly_chart', exc_info=True)
+            PlotlyChartProto = None
+        else:
+            _fast_chart_works = True
+            return element
+    return st.plotly_chart(json.loads(spec), use_container_width=True, key=key)
+
+
+def check_plotly_json_chart():
+    # Renders one figure with st.plotly_chart and with plotly_json_chart and
+    # compares the elements sent to the browser. Run after changing the
+    # Streamlit pin:
+    #   python -m utils.streamlit_components check
+    # Returns a list of differences, empty when the fast path matches.
+    from streamlit.testing.v1 import AppTest
+
+    def app():
+        import plotly.express as px
+        import streamlit as st
+        from utils.streamlit_components import plotly_json_chart
+        fig = px.scatter(x=[1, 2, 3], y=[4, 5, 6], title='check')
+        st.plotly_chart(fig, use_container_width=True)
+        plotly_json_chart(fig.to_json())
+
+    # the app imports this module by name, which is a separate copy when it
+    # is run with python -m
+    import utils.streamlit_components as components
+    at = AppTest.from_function(app).run()
+    if at.exception:
+        return [f'app raised: {at.exception[0].message}']
+    if st.__version__ != FAST_CHART_STREAMLIT_VERSION:
+        return [f'checked on Streamlit {FAST_CHART_STREAMLIT_VERSION}, running {st.__version__}: set FAST_CHART_STREAMLIT_VERSION and check again']
+    if components.PlotlyChartProto is None:
+        return ['streamlit internals unavailable, plotly_json_chart is using st.plotly_chart']
+    charts = at.get('plotly_chart')
+    if len(charts) != 2:
+        return [f'expected 2 charts, found {len(charts)}']
+
+    expected, actual = (chart.proto for chart in charts)
+    problems = []
+    if json.loads(expected.spec) != json.loads(actual.spec):
+        problems.append('spec differs')
+    # the element id hashes the spec text, so it differs whenever the JSON
+    # formatting does and is only checked for being set
+    if not actual.id:
+        problems.append('id is empty')
+    for field in expected.DESCRIPTOR.fields:
+        if field.name in ('spec', 'id'):
+            continue
+        if getattr(expected, field.name) != getattr(actual, field.name):
+            problems.append(f'{field.name}: {getattr(expected, field.name)!r} != {getattr(actual, field.name)!r}')
+    return problems
+
+
+def add_ols_trendline(fig, sums, groups, x, y, color='#636efa'):
+    # Draws the least squares line and 95% confidence band for the selected
+    # groups from precomputed sums (see utils/stats.py)
+    fit = ols_fit(combine_sums(sums, groups))
+    if fit['n'].iloc[0] < 3:
+        return fig
+    xs, ys, lower, upper = ols_band(fit)
+    slope, intercept, r2 = fit[['slope', 'intercept', 'r2']].iloc[0]
+
+    fig.add_trace(go.Scatter(
+        x=np.concatenate([xs, xs[::-1]]),
+        y=np.concatenate([upper, lower[::-1]]),
+        fill='toself',
+        fillcolor='rgba(99, 110, 250, 0.15)',
+        line=dict(width=0),
+        hoverinfo='skip',
+        showlegend=False
+    ))
+    fig.add_trace(go.Scatter(
+        x=xs[[0, -1]],
+        y=ys[[0, -1]],
+        mode='lines',
+        line=dict(color=color),
+        name='OLS trendline',
+        hovertemplate=(
+            f'<b>OLS trendline</b><br>{y} = {slope:.4f} * {x} + {intercept:.4f}'
+            f'<br>R<sup>2</sup>={r2:.6f}<extra></extra>'
+        ),
+        showlegend=False
+    ))
+    return fig
+
+############################################################################
+
+# Above WEBGL_POINTS the movement scatter is drawn with Scattergl, above
+# DENSITY_POINTS crowded regions are binned into hexagons on the server and
+# only the points in sparse bins are sent individually
+WEBGL_POINTS = 2500
+DENSITY_POINTS = 20000
+
+
+def movement_scatter(df, x='pitcher_break_x', y='pitcher_break_z_induced'):
+    hover_data = {'pitcher_name': True, 'avg_speed': ':.1f', 'pitches_thrown': True, 'pitch_per': ':.3f'}
+    if len(df) <= DENSITY_POINTS:
+        return px.scatter(
+            df,
+            x=x,
+            y=y,
+            color='pitch_type_name',
+            hover_data=hover_data,
+            render_mode='webgl' if len(df) > WEBGL_POINTS else 'svg',
+            height=600
+        )
+
+    bins, outliers = density_with_outliers(df, x, y)
+    fig = px.scatter(
+        outliers,
+        x=x,
+        y=y,
+        color='pitch_type_name',
+        hover_data=hover_data,
+        render_mode='webgl',
+        height=600
+    )
+    fig.add_trace(go.Scattergl(
+        x=bins[x],
+        y=bins[y],
+        mode='markers',
+        marker=dict(
+            symbol='hexagon',
+            size=14,
+            color=np.log10(bins['count']),
+            colorscale='Blues',
+            colorbar=dict(title='Pitches', tickprefix='10^', x=1.15)
+        ),
+        customdata=bins['count'],
+        hovertemplate='%{customdata} pitches<extra></extra>',
+        name='Density',
+        showlegend=False
+    ))
+    # keep the density layer underneath the outlier points
+    fig.data = fig.data[-1:] + fig.data[:-1]
+    return fig
+
+
+@st.fragment
+def pitch_movement_chart(seasons=None):
     # Load Data
-    df = pd.read_csv('./data/pitch_movement.csv')
-    df=df.dropna()
-    df=df.rename(columns={'last_name, first_name': 'pitcher_name'})
+    index = load_filter_index(seasons)
+    df = index.frame
 
     # Create Columns
     col1, col2 = st.columns([1, 3], border=True) 
@@ -49,79 +256,134 @@ def pitch_movement_chart():
             max_value=max_speed,
             value=(min_speed, max_speed)
         )
+        st.write("")
+
+        # Movement Outliers
+        upper_quartile_breaks = st.checkbox(
+            "Upper quartile in both breaks",
+            value=False,
+            help="Only pitches in the top 25% of their pitch type for both horizontal and induced vertical break"
+        )
 
     # Right Column: Plot + Table
     with col2:
-        # Filter the dataframe
-        filtered_df = df[
-            df['pitch_type_name'].isin(pitch_types) &
-            df['pitch_hand'].isin(pitch_hand) &
-            (df['avg_speed'] >= speed_range[0]) &
-            (df['avg_speed'] <= speed_range[1])
-        ]
-        if pitchers:
-            filtered_df = filtered_df[filtered_df['pitcher_name'].isin(pitchers)]
-
-        # Plotly scatter
-        fig = px.scatter(
-            filtered_df,
-            x='pitcher_break_x',
-            y='pitcher_break_z_induced',
-            color='pitch_type_name',
-            hover_data=['pitcher_name', 'avg_speed', 'pitches_thrown', 'pitch_per'],
-            height=600
+        def build_figure():
+            # Filter the dataframe
+            filtered_df = index.filter(pitch_types, pitch_hand, speed_range, pitchers, upper_quartile_breaks)
+
+            # Plotly scatter
+            return movement_scatter(filtered_df)
+
+        filters = (
+            normalize(seasons), normalize(pitch_types), normalize(pitchers), normalize(pitch_hand),
+            tuple(speed_range), upper_quartile_breaks
         )
-        st.plotly_chart(fig, use_container_width=True)
+        plotly_json_chart(figure_json('pitch_movement', filters, build_figure, seasons))
+
+        # picking a pitch needs the rows narrowed to a few pitchers first, so
+        # the options stay small however many pitches are stored
+        if not pitchers:
+            st.caption('Choose a pitcher to see their most similar pitches and what drives their elite probability.')
+            return
+        pitch = select_pitch(index, index.rows(pitch_types, pitch_hand, speed_range, pitchers, upper_quartile_breaks))
+        if pitch is not None:
+            similar_pitches(pitch, seasons)
+            try:
+                explain_pitch(pitch)
+            except FileNotFoundError:
+                st.caption('Pitch explanations are not available for the current model.')
+
+
+def select_pitch(index, rows):
+    # rows are positions in index.frame, labelled from the prebuilt index.labels
+    row = st.selectbox(
+        'Choose a pitch',
+        options=rows.tolist(),
+        index=None,
+        format_func=index.labels.__getitem__,
+        placeholder='See the most similar pitches and what drives its elite probability',
+    )
+    return None if row is None else index.frame.iloc[row]
+
+
+def similar_pitches(pitch, seasons=None):
+    # Nearest movement profiles from the prebuilt KD-tree index (see utils/similarity.py)
+    index = load_similarity_index(seasons)
+    year, key = int(pitch['year']), int(pitch['pitch_key'])
+    outlier = index.outlier_percentile[index.row(year, key)]
+    pitch_type = pitch['pitch_type_name'].lower()
+    if np.isnan(outlier):
+        st.write(f"**Most similar movement.** This is the only {pitch_type} in the data, so there are no others to compare its movement with.")
+    else:
+        st.write(f"**Most similar movement.** This {pitch_type}'s movement is more unusual than {outlier:.0%} of other {pitch_type}s.")
+    same_type = st.toggle('Same pitch type only', value=False)
+    st.dataframe(
+        index.similar(year, key, k=10, same_type=same_type)[
+            ['pitcher_name', 'pitch_type_name', 'pitcher_break_x', 'pitcher_break_z_induced', 'avg_speed', 'pitch_per', 'distance']
+        ],
+        hide_index=True,
+        column_config={
+            'pitcher_name': st.column_config.TextColumn('Pitcher'),
+            'pitch_type_name': st.column_config.TextColumn('Pitch'),
+            'pitcher_break_x': st.column_config.NumberColumn('Horz Break', format='%.1f'),
+            'pitcher_break_z_induced': st.column_config.NumberColumn('Vert Break', format='%.1f'),
+            'avg_speed': st.column_config.NumberColumn('Speed', format='%.1f'),
+            'pitch_per': st.column_config.NumberColumn('Usage', format='%.3f'),
+            'distance': st.column_config.NumberColumn('Distance', format='%.2f', help='In standard deviations of movement'),
+        }
+    )
+
+
+def attribution_label(feature, pitch):
+    # Model feature with the pitch's raw value, e.g. 'xSLG = 0.257'
+    if feature.startswith('pitch_hand_'):
+        return f"Pitch Hand = {pitch['pitch_hand']}"
+    label, _, number_format = SCORE_INPUTS[feature]
+    return f'{label} = {number_format % pitch[feature]}'
+
+
+def attribution_figure(pitch, base, contributions):
+    # base is the forest's root value. The forest is trained with balanced
+    # class weights, so it sits near 50% by construction rather than at the
+    # 25% share of pitches that are elite.
+    labels = [attribution_label(feature, pitch) for feature in contributions.index]
+    fig = go.Figure(go.Bar(
+        x=contributions.to_numpy()[::-1],
+        y=labels[::-1],
+        orientation='h',
+        marker_color=np.where(contributions.to_numpy()[::-1] > 0, '#2ca02c', '#d62728'),
+        hovertemplate='%{y}: %{x:+.3f}<extra></extra>'
+    ))
+    fig.update_layout(
+        title=f"{pitch['pitcher_name']} {pitch['pitch_type_name']}: {base + contributions.sum():.0%} elite "
+              f"(from the model's balanced prior of {base:.0%})",
+        xaxis_title='Change in elite probability',
+        height=400
+    )
+    return fig
+
+
+def explain_pitch(pitch):
+    # Why the model rates a pitch the way it does, looked up from the
+    # attributions precomputed for the active model (see utils/explain.py)
+    year, key = int(pitch['year']), int(pitch['pitch_key'])
+    if (year, key) not in load_attributions().index:
+        st.caption('The model does not score this pitch, some of its features are missing.')
+        return
+
+    def build_figure():
+        base, contributions = pitch_attribution(year, key)
+        return attribution_figure(pitch, base, contributions)
+
+    plotly_json_chart(figure_json('pitch_attribution', (year, key, active_version()), build_figure, [year]))
 ############################################################################
 
-def pitch_performance_vs_usage():
+@st.fragment
+def pitch_performance_vs_usage(seasons=None):
     # Do the best performing pitches get thrown the most? 
-    df_pitch_movement = pd.read_csv('./data/pitch_movement.csv')
-    df_pitch_stats = pd.read_csv('./data/pitch-arsenal-stats.csv')
-
-    df_pitch_movement['pitcherId_pitchType'] = df_pitch_movement['pitcher_id'].astype(str) + '_' + df_pitch_movement['pitch_type']
-    df_pitch_stats['pitcherId_pitchType'] = df_pitch_stats['player_id'].astype(str) + '_' + df_pitch_stats['pitch_type']
-    df_pitch_movement = df_pitch_movement.dropna()
-    df_pitch_movement.rename(columns={'last_name, first_name': 'pitcher_name'}, inplace=True)
-
-    # filter data for relevant columns
-    df_pitch_movement = df_pitch_movement[[
-        'pitcher_name',	
-        'pitcher_id',	
-        'team_name_abbrev',	
-        'pitch_hand',
-        'pitch_type',
-        'pitch_type_name',
-        'avg_speed',
-        'pitches_thrown',
-        'total_pitches',
-        'pitch_per',
-        'pitcher_break_z',
-        'pitcher_break_z_induced',
-        'pitcher_break_x',
-        'pitcherId_pitchType'
-    ]]
-
-    df_pitch_stats = df_pitch_stats[[
-        'ba',	
-        'slg',	
-        'woba',	
-        'whiff_percent',	
-        'k_percent',	
-        'put_away',	
-        'est_ba',	
-        'est_slg',	
-        'est_woba',	
-        'hard_hit_percent',
-        'pitcherId_pitchType'
-    ]]
-
-
-    # left join on movement
-    df_merged = df_pitch_movement.merge(df_pitch_stats, on='pitcherId_pitchType', how='left', suffixes=('_movement', '_stats'))
-    
-    
-    
+    df_merged = load_pitch_data(seasons)
+    ols_sums = load_ols_sums('est_slg', 'pitch_per', 'pitch_type_name', seasons)
+
     col1, col2 = st.columns([1,3], border=True)
     with col1:
         # Pitch Type
@@ -135,39 +397,95 @@ def pitch_performance_vs_usage():
         st.write("")
     with col2:
 
-        # Filter the dataframe
-        filtered_df = df_merged[
-            df_merged['pitch_type_name'].isin(pitch_types)
-            # df_merged['pitch_hand'].isin(pitch_hand) &
-            # (df_merged['avg_speed'] >= speed_range[0]) &
-            # (df_merged['avg_speed'] <= speed_range[1])
-        ]
-        # if pitchers:
-        #     filtered_df = filtered_df[filtered_df['pitcher_name'].isin(pitchers)]
+        def build_figure():
+            # Filter the dataframe
+            filtered_df = df_merged[
+                df_merged['pitch_type_name'].isin(pitch_types)
+                # df_merged['pitch_hand'].isin(pitch_hand) &
+                # (df_merged['avg_speed'] >= speed_range[0]) &
+                # (df_merged['avg_speed'] <= speed_range[1])
+            ]
+            # if pitchers:
+            #     filtered_df = filtered_df[filtered_df['pitcher_name'].isin(pitchers)]
 
+            fig = px.scatter(
+                filtered_df,
+                x='est_slg',
+                y='pitch_per',
+                color='whiff_percent',
+                hover_data={
+                    'pitcher_name': True,
+                    'pitch_type': True,
+                    'whiff_percent': ':.1f',
+                    'est_ba': ':.3f',
+                    'est_woba': ':.3f',
+                    'hard_hit_percent': ':.1f'
+                },
+                height=600,
+                title='Pitch Usage vs Estimated Slugging Percentage (xSLG)'
+            )
+            add_ols_trendline(fig, ols_sums, pitch_types, x='est_slg', y='pitch_per')
+            fig.add_vline(
+                x=0.42, 
+                line_width=2, 
+                line_dash="dash", 
+                line_color="red", 
+                annotation_text="MLB Average xSLG",
+                annotation_font_size=14,
+                annotation_font_color='red')
+            return fig
 
+        filters = (normalize(seasons), normalize(pitch_types))
+        plotly_json_chart(figure_json('pitch_performance_vs_usage', filters, build_figure, seasons))
 
+############################################################################
 
+SCORE_INPUTS = {
+    # feature: (label, step, format)
+    'pitch_per': ('Usage (share of pitches)', 0.01, '%.3f'),
+    'pitcher_break_z_induced': ('Induced Vertical Break (in)', 0.5, '%.1f'),
+    'pitcher_break_x': ('Horizontal Break (in)', 0.5, '%.1f'),
+    'avg_speed': ('Average Speed (mph)', 0.5, '%.1f'),
+    'est_ba': ('xBA', 0.005, '%.3f'),
+    'est_slg': ('xSLG', 0.005, '%.3f'),
+    'est_woba': ('xwOBA', 0.005, '%.3f'),
+    'hard_hit_percent': ('Hard Hit %', 0.5, '%.1f'),
+}
 
 
-        fig = px.scatter(
-            filtered_df,
-            x='est_slg',
-            y='pitch_per',
-            color='whiff_percent',
-            hover_data=['pitcher_name', 'pitch_type', 'est_ba', 'est_woba', 'hard_hit_percent'],
-            height=600,
-            trendline='ols',
-            title='Pitch Usage vs Estimated Slugging Percentage (xSLG)'
-        )
-        fig.add_vline(
-            x=0.42, 
-            line_width=2, 
-            line_dash="dash", 
-            line_color="red", 
-            annotation_text="MLB Average xSLG",
-            annotation_font_size=14,
-            annotation_font_color='red')
-        st.plotly_chart(fig, use_container_width=True)
+@st.fragment
+def score_pitch_widget(seasons=None):
+    # Scores a user-described pitch with the saved model
+    scorer = load_scorer()
+    defaults = load_pitch_data(seasons)[list(SCORE_INPUTS)].median()
+
+    with st.form('score_pitch'):
+        pitch = {}
+        input_cols = st.columns(4)
+        for i, (feature, (label, step, number_format)) in enumerate(SCORE_INPUTS.items()):
+            with input_cols[i % 4]:
+                pitch[feature] = st.number_input(
+                    label,
+                    value=round(float(defaults[feature]), 3),
+                    step=step,
+                    format=number_format
+                )
+        pitch['pitch_hand'] = st.radio('Pitch Hand', ['R', 'L'], horizontal=True)
+        submitted = st.form_submit_button('Score Pitch')
+
+    if submitted:
+        probability = scorer.score(pitch)[0]
+        st.metric('Probability of an elite (top 25% whiff) pitch', f'{probability:.0%}')
+
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Checks for the custom Streamlit components')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('check', help='Compare plotly_json_chart with st.plotly_chart, exits 1 on a difference')
+    args = parser.parse_args()
 
+    problems = check_plotly_json_chart()
+    for problem in problems:
+        print(f'mismatch: {problem}')
+    print('plotly_json_chart matches st.plotly_chart' if not problems else f'{len(problems)} differences')
+    sys.exit(1 if problems else 0)